@@ -1,16 +1,42 @@
 import os
+import platform
 import re
 import sys
 import time
 import threading
+import subprocess
 import requests
 import io
-from flask import Flask, request, render_template_string, Response, redirect, url_for, jsonify
-from functools import wraps
+import hashlib
+import json
+import math
+import queue
+import select
+import sqlite3
+import csv
+import tempfile
+import gzip
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
+from contextlib import closing
+from dataclasses import asdict, dataclass, field, replace
+from flask import Flask, request, render_template, stream_template, Response, redirect, url_for, jsonify
+from functools import cache, wraps
 from dotenv import load_dotenv
 from datetime import datetime
 from PIL import Image
-import pytesseract
+import ocr_worker
+try:
+    import brotli  # optional; without it responses are gzip-encoded only
+except ImportError:
+    brotli = None
+try:
+    import psycopg2  # optional; only STATE_BACKEND=postgres needs it
+    import psycopg2.extensions
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
 
 # Load environment variables from a .env file
 load_dotenv()
@@ -19,23 +45,1397 @@ load_dotenv()
 BANDWIDTH_ACCOUNT_ID = os.getenv("BANDWIDTH_ACCOUNT_ID")
 BANDWIDTH_API_TOKEN = os.getenv("BANDWIDTH_API_TOKEN")
 BANDWIDTH_API_SECRET = os.getenv("BANDWIDTH_API_SECRET")
+BANDWIDTH_MESSAGING_URL = os.getenv("BANDWIDTH_MESSAGING_URL", "https://messaging.bandwidth.com/api/v2")
 TF_NUMBER = os.getenv("TF_NUMBER")
 TF_APP_ID = os.getenv("TF_APP_ID")
 TEN_DLC_NUMBER = os.getenv("TEN_DLC_NUMBER")
 TEN_DLC_APP_ID = os.getenv("TEN_DLC_APP_ID")
 APP_USERNAME = os.getenv("APP_USERNAME", "admin")
 APP_PASSWORD = os.getenv("APP_PASSWORD", "password")
+FROM_NUMBERS = [{"name": "TF", "number": TF_NUMBER, "appId": TF_APP_ID}, {"name": "10DLC", "number": TEN_DLC_NUMBER, "appId": TEN_DLC_APP_ID}]
 
 def parse_destinations(dest_str):
     if not dest_str: return []
     # Regex to find a number and an optional name in parentheses
     return re.findall(r'(\+\d{11})\s*(?:\(([^)]+)\))?', dest_str)
 DESTINATION_NUMBERS = parse_destinations(os.getenv("DESTINATION_NUMBERS", ""))
+DESTINATION_CARRIERS = {number: name for number, name in DESTINATION_NUMBERS if name}
 STATIC_MMS_IMAGE_URL = "https://i.imgur.com/e3j2F0u.png"
 CARRIER_LIMITS = {"AT&T": 1000, "T-Mobile": 1000, "Verizon": 1200, "Toll-Free": 525}
+MEDIA_MAX_BYTES = max(CARRIER_LIMITS.values()) * 1024  # nothing larger is accepted by any carrier, so never buffer more
+MEDIA_HEADER_BYTES = 64 * 1024  # enough of an oversized file to read its image dimensions
+
+BATCH_TIMEOUT_SECONDS = 125
+SENDER_POOL_SIZE = int(os.getenv("SENDER_POOL_SIZE", "16"))
+# Messages per second allowed from each sender; keep below the campaign's approved throughput. With STATE_BACKEND=sqlite
+# they are totals for the host (every worker draws from one bucket per sender in STATE_DB_PATH); with postgres, for every
+# instance sharing STATE_DATABASE_URL. CAMPAIGN_WINDOW below stays per worker; it bounds queueing, not throughput.
+SENDER_RATE_LIMITS = {"TF": float(os.getenv("TF_RATE_LIMIT", "20")), "10DLC": float(os.getenv("TEN_DLC_RATE_LIMIT", "10"))}
+TEST_TTL_SECONDS = int(os.getenv("TEST_TTL_SECONDS", "900"))
+# Messages per sender a campaign may have queued or in flight at once; the feeder waits for a free slot before adding more.
+CAMPAIGN_WINDOW = int(os.getenv("CAMPAIGN_WINDOW", str(max(2, SENDER_POOL_SIZE // 2))))
+CAMPAIGN_MAX_DESTINATIONS = int(os.getenv("CAMPAIGN_MAX_DESTINATIONS", "10000"))
+CAMPAIGN_CARRIER_MAX_LENGTH = 40
+ABANDONED_BATCH_SECONDS = 86400  # an unsealed batch this old lost its feeder (e.g. a worker restart) and is evicted
+PENDING_STATUSES = ("Sending...", "Sent")
+# "memory" keeps tests in this process only. "sqlite" shares them between the gunicorn workers of one host via
+# STATE_DB_PATH, which must be on local disk: SQLite's locking doesn't hold on a volume mounted by several hosts or
+# containers. "postgres" shares them between every worker of every instance via STATE_DATABASE_URL.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "/tmp/sms_latency_state.db")
+STATE_DATABASE_URL = os.getenv("STATE_DATABASE_URL", os.getenv("DATABASE_URL", ""))
+STATE_DB_POOL_SIZE = int(os.getenv("STATE_DB_POOL_SIZE", "10"))  # Postgres connections per worker
+# How often waiters re-check shared state; postgres waiters are woken by NOTIFY, so for them this is only a fallback.
+STATE_POLL_INTERVAL = float(os.getenv("STATE_POLL_INTERVAL", "5" if STATE_BACKEND == "postgres" else "0.25"))
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "latency_history.db")
+METRICS_REQUIRE_AUTH = os.getenv("METRICS_REQUIRE_AUTH", "false").lower() in ("1", "true", "yes")
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 2)))
+OCR_QUEUE_LIMIT = int(os.getenv("OCR_QUEUE_LIMIT", "8"))  # OCR jobs running or waiting before new ones are skipped
+OCR_BATCH_QUEUE_LIMIT = int(os.getenv("OCR_BATCH_QUEUE_LIMIT", "16"))  # the same bound, shared by all bulk analyses
+OCR_BATCH_WAIT_SECONDS = float(os.getenv("OCR_BATCH_WAIT_SECONDS", "60"))
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "10"))
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "1600"))
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "16"))
+BATCH_ANALYSIS_MAX_URLS = int(os.getenv("BATCH_ANALYSIS_MAX_URLS", "500"))
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "512"))  # smaller bodies are sent as-is
+COMPRESSIBLE_MIMETYPES = {"text/html", "text/plain", "text/css", "application/javascript", "application/json"}
+
+# --- TEST REGISTRY ---
+@dataclass(slots=True)
+class TestRecord:
+    test_id: str
+    batch_id: str | None = None
+    from_name: str = ""
+    from_num: str = ""
+    to_num: str = ""
+    carrier_name: str = "N/A"
+    type: str = ""
+    status: str = "Sending..."
+    latency: float | None = None
+    start_time: float | None = None
+    message_id: str | None = None
+    error: str | None = None
+    events: dict = field(default_factory=dict)
+    done: bool = False
+    created_at: float = field(default_factory=time.time)
+
+    def to_row(self):
+        return {"test_id": self.test_id, "batch_id": self.batch_id, "from_name": self.from_name, "from_num": self.from_num, "to_num": self.to_num,
+                "carrier_name": self.carrier_name, "type": self.type, "status": self.status, "latency": self.latency, "start_time": self.start_time,
+                "clock_skew": self.events.get("clock_skew"), "overhead": clock_report(self)[1]}
+
+@dataclass(slots=True)
+class BatchRecord:
+    batch_id: str
+    start_time: float = field(default_factory=time.time)
+    test_ids: list = field(default_factory=list)
+    changes: list = field(default_factory=list)  # test_id per change; the batch version is len(changes)
+    pending: int = 0
+    timed_out: bool = False
+    sealed_at: float | None = None  # set once every test has been added; campaigns stay open while their upload is read
+    skipped: int = 0
+    errors: list = field(default_factory=list)
+    summary: dict = field(default_factory=dict)
+
+    @property
+    def version(self):
+        return len(self.changes)
+
+def tally_finished(summary, record):
+    """Fold one finished test into a batch summary, so progress reads never rescan the batch's tests."""
+    outcome = outcome_for(record.status)
+    summary["finished"] = summary.get("finished", 0) + 1
+    group = summary.setdefault("groups", {}).setdefault(f"{record.type}|{record.from_name}|{record.carrier_name}", {"outcomes": {}, "bins": {}})
+    group["outcomes"][outcome] = group["outcomes"].get(outcome, 0) + 1
+    if outcome == "delivered" and record.latency is not None:
+        index = str(LatencyHistory.bin_index(record.latency))  # str keys so the summary survives a JSON round trip
+        group["bins"][index] = group["bins"].get(index, 0) + 1
+
+def batch_progress(batch_id, size, pending, timed_out, sealed_at, skipped, errors, summary):
+    return {"batch_id": batch_id, "total": size, "pending": pending, "finished": summary.get("finished", 0), "sealed": sealed_at is not None,
+            "is_complete": sealed_at is not None and (pending == 0 or timed_out), "timed_out": timed_out,
+            "skipped": skipped, "errors": errors, "summary": summary}
+
+def time_out_pending(test):
+    if test.status in PENDING_STATUSES:
+        test.status = "Timed Out"
+
+class TestRegistry:
+    """Store of in-flight tests, indexed by batch so status lookups cost O(batch size).
+
+    Implementations provide create_batch, seal_batch, add, get, update, poll_batch, batch_changes, batch_progress,
+    expire_stale and evict_expired; every update is atomic and wakes anyone blocked in batch_changes. A batch only
+    completes once it is sealed, and its timeout and TTL run from that moment. Eviction first applies any timeouts
+    no reader has triggered, so every test reaches the finish listeners whether or not a page was left open.
+    """
+    def __init__(self, ttl=TEST_TTL_SECONDS):
+        self.ttl = ttl
+        self.finish_listeners = []
+        self._reaper = None
+
+    def _fire_finished(self, records):
+        """Call each finish listener once per test that just left a pending status."""
+        for record in records:
+            for listener in self.finish_listeners:
+                listener(record)
+
+    @staticmethod
+    def _finished_copy(record, was_pending):
+        if was_pending and record.status not in PENDING_STATUSES:
+            return [replace(record, events=dict(record.events or {}))]
+        return []
+
+    def start_reaper(self, interval=60):
+        def reap():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_expired()
+                except Exception as e:  # e.g. a lock timeout; the next pass retries
+                    print(f"Test registry reaper failed: {e}", file=sys.stderr)
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=reap, daemon=True, name="test-registry-reaper")
+            self._reaper.start()
+
+class InMemoryTestRegistry(TestRegistry):
+    """Process-local registry; webhooks must land on the worker that sent the message."""
+    def __init__(self, ttl=TEST_TTL_SECONDS):
+        super().__init__(ttl)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._tests = {}
+        self._batches = {}
+
+    def create_batch(self, batch_id, sealed=True):
+        with self._lock:
+            batch = self._batches[batch_id] = BatchRecord(batch_id)
+            if sealed: batch.sealed_at = batch.start_time
+
+    def seal_batch(self, batch_id, skipped=0, errors=()):
+        with self._changed:
+            batch = self._batches.get(batch_id)
+            if batch:
+                batch.sealed_at, batch.skipped, batch.errors = time.time(), skipped, list(errors)
+                self._changed.notify_all()
+
+    def add(self, record):
+        with self._lock:
+            self._tests[record.test_id] = record
+            batch = self._batches.get(record.batch_id)
+            if batch:
+                batch.test_ids.append(record.test_id)
+                batch.pending += record.status in PENDING_STATUSES
+                self._record_change(batch, record.test_id)
+
+    def get(self, test_id):
+        with self._lock:
+            return self._tests.get(test_id)
+
+    def update(self, test_id, mutate):
+        """Apply `mutate(record)` atomically; returns the record, or None if the test is unknown."""
+        finished = []
+        with self._lock:
+            record = self._tests.get(test_id)
+            if record is not None:
+                was_pending = record.status in PENDING_STATUSES
+                mutate(record)
+                finished = self._finished_copy(record, was_pending)
+                batch = self._batches.get(record.batch_id)
+                if batch:
+                    batch.pending += (record.status in PENDING_STATUSES) - was_pending
+                    if finished: tally_finished(batch.summary, record)
+                    self._record_change(batch, test_id)
+        self._fire_finished(finished)
+        return record
+
+    def _record_change(self, batch, test_id):
+        batch.changes.append(test_id)
+        self._changed.notify_all()
+
+    def _check_batch(self, batch, timeout, finished, now=None):
+        """Return whether a batch is complete, marking stragglers as timed out once `timeout` has passed."""
+        if batch.sealed_at is None:
+            return False
+        if batch.pending and not batch.timed_out and (now or time.time()) - batch.sealed_at > timeout:
+            batch.timed_out = True
+            for test_id in batch.test_ids:
+                test = self._tests.get(test_id)
+                if test and test.status in PENDING_STATUSES:
+                    time_out_pending(test)
+                    finished.extend(self._finished_copy(test, True))
+                    tally_finished(batch.summary, test)
+                    batch.pending -= 1
+                    self._record_change(batch, test_id)
+        return batch.pending == 0 or batch.timed_out
+
+    def poll_batch(self, batch_id, timeout=BATCH_TIMEOUT_SECONDS):
+        """Return (is_complete, rows) for every test in a batch."""
+        finished = []
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return True, []
+            is_complete = self._check_batch(batch, timeout, finished)
+            rows = [self._tests[tid].to_row() for tid in batch.test_ids if tid in self._tests]
+        self._fire_finished(finished)
+        return is_complete, rows
+
+    def batch_changes(self, batch_id, cursor=0, wait=0, timeout=BATCH_TIMEOUT_SECONDS):
+        """Block up to `wait` seconds for changes after `cursor`; returns (version, is_complete, changed rows)."""
+        deadline = time.monotonic() + wait
+        finished = []
+        with self._changed:
+            while True:
+                batch = self._batches.get(batch_id)
+                if batch is None:
+                    result = cursor, True, []
+                    break
+                if cursor > batch.version:
+                    cursor = 0  # the cursor belongs to an older process; resend everything
+                is_complete = self._check_batch(batch, timeout, finished)
+                remaining = deadline - time.monotonic()
+                if batch.version > cursor or is_complete or remaining <= 0:
+                    changed = dict.fromkeys(batch.changes[cursor:])
+                    result = batch.version, is_complete, [self._tests[tid].to_row() for tid in changed if tid in self._tests]
+                    break
+                self._changed.wait(remaining)
+        self._fire_finished(finished)
+        return result
+
+    def batch_progress(self, batch_id, timeout=BATCH_TIMEOUT_SECONDS):
+        """Return counts and the incremental summary for a batch, or None if it is unknown."""
+        finished = []
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            self._check_batch(batch, timeout, finished)
+            progress = batch_progress(batch_id, len(batch.test_ids), batch.pending, batch.timed_out, batch.sealed_at,
+                                      batch.skipped, list(batch.errors), json.loads(json.dumps(batch.summary)))
+        self._fire_finished(finished)
+        return progress
+
+    def _remove_batch(self, batch_id):
+        batch = self._batches.pop(batch_id, None)
+        if batch:
+            for tid in batch.test_ids: self._tests.pop(tid, None)
+
+    def expire_stale(self, now=None, timeout=BATCH_TIMEOUT_SECONDS):
+        """Time out overdue batches and single tests, firing the finish listeners for each."""
+        now = now or time.time()
+        finished = []
+        with self._lock:
+            for batch in self._batches.values():
+                self._check_batch(batch, timeout, finished, now)
+            stale = [tid for tid, t in self._tests.items()
+                     if t.batch_id is None and t.status in PENDING_STATUSES and now - t.created_at > single_test_timeout(t)]
+        self._fire_finished(finished)
+        for test_id in stale:
+            self.update(test_id, time_out_pending)
+
+    def evict_expired(self, now=None):
+        """Drop batches and single tests older than the TTL; finished results stay readable until then."""
+        now = now or time.time()
+        self.expire_stale(now)
+        cutoff, abandoned = now - self.ttl, now - ABANDONED_BATCH_SECONDS
+        with self._lock:
+            for batch_id in [bid for bid, b in self._batches.items() if (b.sealed_at or b.start_time) < (cutoff if b.sealed_at else abandoned)]:
+                self._remove_batch(batch_id)
+            for test_id in [tid for tid, t in self._tests.items() if t.batch_id is None and t.created_at < cutoff]:
+                del self._tests[test_id]
+
+class SQLiteTestRegistry(TestRegistry):
+    """Registry shared by every worker on the host through one SQLite file.
+
+    Writes run in IMMEDIATE transactions so concurrent webhooks serialize per update. Waiters in this
+    process are woken directly; waiters in other processes notice the batch version change on their next poll.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, start_time REAL, size INTEGER DEFAULT 0,
+                                            pending INTEGER DEFAULT 0, timed_out INTEGER DEFAULT 0, version INTEGER DEFAULT 0,
+                                            sealed_at REAL, skipped INTEGER DEFAULT 0, errors TEXT DEFAULT '[]', summary TEXT DEFAULT '{}');
+        CREATE TABLE IF NOT EXISTS tests (test_id TEXT PRIMARY KEY, batch_id TEXT, seq INTEGER, created_at REAL, data TEXT);
+        CREATE INDEX IF NOT EXISTS tests_by_batch ON tests (batch_id, seq);
+        CREATE TABLE IF NOT EXISTS changes (batch_id TEXT, version INTEGER, test_id TEXT, PRIMARY KEY (batch_id, version));
+    """
+    BEGIN = "BEGIN IMMEDIATE"
+    FOR_UPDATE = ""  # IMMEDIATE already locks the whole database
+
+    def __init__(self, path=STATE_DB_PATH, ttl=TEST_TTL_SECONDS, poll_interval=STATE_POLL_INTERVAL):
+        super().__init__(ttl)
+        self.path = path
+        self.poll_interval = poll_interval
+        self._changed = threading.Condition()
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(batches)")}
+            for column, ddl in (("sealed_at", "REAL"), ("skipped", "INTEGER DEFAULT 0"), ("errors", "TEXT DEFAULT '[]'"), ("summary", "TEXT DEFAULT '{}'")):
+                if column not in columns:  # state files written before campaigns existed
+                    conn.execute(f"ALTER TABLE batches ADD COLUMN {column} {ddl}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write(self, work):
+        """Run `work(conn)` inside a write transaction, then wake local waiters."""
+        with closing(self._connect()) as conn:
+            conn.execute(self.BEGIN)
+            try:
+                result = work(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        with self._changed:
+            self._changed.notify_all()
+        return result
+
+    @staticmethod
+    def _load(data):
+        return TestRecord(**json.loads(data))
+
+    @staticmethod
+    def _store(conn, record):
+        conn.execute("UPDATE tests SET data = ? WHERE test_id = ?", (json.dumps(asdict(record)), record.test_id))
+
+    @staticmethod
+    def _record_change(conn, batch_id, test_id):
+        version = conn.execute("UPDATE batches SET version = version + 1 WHERE batch_id = ? RETURNING version", (batch_id,)).fetchone()[0]
+        conn.execute("INSERT INTO changes (batch_id, version, test_id) VALUES (?, ?, ?)", (batch_id, version, test_id))
+
+    def create_batch(self, batch_id, sealed=True):
+        now = time.time()
+        self._write(lambda conn: conn.execute("INSERT INTO batches (batch_id, start_time, sealed_at) VALUES (?, ?, ?) ON CONFLICT (batch_id) "
+                                              "DO UPDATE SET start_time = excluded.start_time, sealed_at = excluded.sealed_at",
+                                              (batch_id, now, now if sealed else None)))
+
+    def seal_batch(self, batch_id, skipped=0, errors=()):
+        self._write(lambda conn: conn.execute("UPDATE batches SET sealed_at = ?, skipped = ?, errors = ? WHERE batch_id = ?",
+                                              (time.time(), skipped, json.dumps(list(errors)), batch_id)))
+
+    @staticmethod
+    def _tally(conn, batch_id, record):
+        summary = json.loads(conn.execute("SELECT summary FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()[0] or "{}")
+        tally_finished(summary, record)
+        conn.execute("UPDATE batches SET summary = ? WHERE batch_id = ?", (json.dumps(summary), batch_id))
+
+    def add(self, record):
+        def work(conn):
+            in_batch = conn.execute("UPDATE batches SET size = size + 1 WHERE batch_id = ? RETURNING size", (record.batch_id,)).fetchone()
+            seq = in_batch[0] if in_batch else 0
+            conn.execute("INSERT INTO tests (test_id, batch_id, seq, created_at, data) VALUES (?, ?, ?, ?, ?) ON CONFLICT (test_id) DO UPDATE SET "
+                         "batch_id = excluded.batch_id, seq = excluded.seq, created_at = excluded.created_at, data = excluded.data",
+                         (record.test_id, record.batch_id, seq, record.created_at, json.dumps(asdict(record))))
+            if in_batch:
+                conn.execute("UPDATE batches SET pending = pending + ? WHERE batch_id = ?", (int(record.status in PENDING_STATUSES), record.batch_id))
+                self._record_change(conn, record.batch_id, record.test_id)
+        self._write(work)
+
+    def get(self, test_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT data FROM tests WHERE test_id = ?", (test_id,)).fetchone()
+        return self._load(row[0]) if row else None
+
+    def update(self, test_id, mutate):
+        def work(conn):
+            row = conn.execute(f"SELECT data FROM tests WHERE test_id = ?{self.FOR_UPDATE}", (test_id,)).fetchone()
+            if row is None:
+                return None
+            record = self._load(row[0])
+            was_pending = record.status in PENDING_STATUSES
+            mutate(record)
+            finished.extend(self._finished_copy(record, was_pending))
+            self._store(conn, record)
+            if record.batch_id is not None and conn.execute("SELECT 1 FROM batches WHERE batch_id = ?", (record.batch_id,)).fetchone():
+                conn.execute("UPDATE batches SET pending = pending + ? WHERE batch_id = ?",
+                             ((record.status in PENDING_STATUSES) - was_pending, record.batch_id))
+                if finished: self._tally(conn, record.batch_id, record)
+                self._record_change(conn, record.batch_id, test_id)
+            return record
+        finished = []
+        record = self._write(work)
+        self._fire_finished(finished)
+        return record
+
+    def _check_batch(self, batch_id, timeout, now=None):
+        """Same completion rule as the in-memory registry; returns (version, is_complete) or None."""
+        with closing(self._connect()) as conn:
+            batch = conn.execute("SELECT sealed_at, pending, timed_out, version FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        if batch is None:
+            return None
+        sealed_at, pending, timed_out, version = batch
+        if sealed_at is None:
+            return version, False
+        if pending and not timed_out and (now or time.time()) - sealed_at > timeout:
+            def work(conn):
+                # test rows are locked before the batch row, in the same order update() takes them
+                tests = conn.execute(f"SELECT test_id, data FROM tests WHERE batch_id = ? ORDER BY seq{self.FOR_UPDATE}", (batch_id,)).fetchall()
+                if conn.execute("UPDATE batches SET timed_out = 1 WHERE batch_id = ? AND timed_out = 0", (batch_id,)).rowcount == 0:
+                    return
+                for test_id, data in tests:
+                    record = self._load(data)
+                    if record.status in PENDING_STATUSES:
+                        time_out_pending(record)
+                        finished.extend(self._finished_copy(record, True))
+                        self._store(conn, record)
+                        self._tally(conn, batch_id, record)
+                        conn.execute("UPDATE batches SET pending = pending - 1 WHERE batch_id = ?", (batch_id,))
+                        self._record_change(conn, batch_id, test_id)
+            finished = []
+            self._write(work)
+            self._fire_finished(finished)
+            return self._check_batch(batch_id, timeout, now)
+        return version, pending == 0 or bool(timed_out)
+
+    def poll_batch(self, batch_id, timeout=BATCH_TIMEOUT_SECONDS):
+        state = self._check_batch(batch_id, timeout)
+        if state is None:
+            return True, []
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT data FROM tests WHERE batch_id = ? ORDER BY seq", (batch_id,)).fetchall()
+        return state[1], [self._load(data).to_row() for (data,) in rows]
+
+    def batch_changes(self, batch_id, cursor=0, wait=0, timeout=BATCH_TIMEOUT_SECONDS):
+        deadline = time.monotonic() + wait
+        while True:
+            state = self._check_batch(batch_id, timeout)
+            if state is None:
+                return cursor, True, []
+            version, is_complete = state
+            if cursor > version:
+                cursor = 0
+            remaining = deadline - time.monotonic()
+            if version > cursor or is_complete or remaining <= 0:
+                with closing(self._connect()) as conn:
+                    rows = conn.execute(
+                        "SELECT t.data FROM tests t JOIN (SELECT DISTINCT test_id FROM changes WHERE batch_id = ? AND version > ? AND version <= ?) c "
+                        "ON t.test_id = c.test_id ORDER BY t.seq", (batch_id, cursor, version)).fetchall()
+                return version, is_complete, [self._load(data).to_row() for (data,) in rows]
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, remaining))
+
+    def batch_progress(self, batch_id, timeout=BATCH_TIMEOUT_SECONDS):
+        if self._check_batch(batch_id, timeout) is None:
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT size, pending, timed_out, sealed_at, skipped, errors, summary FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+        if row is None:
+            return None
+        size, pending, timed_out, sealed_at, skipped, errors, summary = row
+        return batch_progress(batch_id, size, pending, bool(timed_out), sealed_at, skipped, json.loads(errors or "[]"), json.loads(summary or "{}"))
+
+    def expire_stale(self, now=None, timeout=BATCH_TIMEOUT_SECONDS):
+        now = now or time.time()
+        with closing(self._connect()) as conn:
+            overdue = conn.execute("SELECT batch_id FROM batches WHERE sealed_at < ? AND pending > 0 AND timed_out = 0", (now - timeout,)).fetchall()
+            singles = conn.execute("SELECT test_id, data FROM tests WHERE batch_id IS NULL").fetchall()
+        for (batch_id,) in overdue:
+            self._check_batch(batch_id, timeout, now)
+        for test_id, data in singles:
+            record = self._load(data)
+            if record.status in PENDING_STATUSES and now - record.created_at > single_test_timeout(record):
+                self.update(test_id, time_out_pending)
+
+    def evict_expired(self, now=None):
+        now = now or time.time()
+        self.expire_stale(now)
+        cutoff, abandoned = now - self.ttl, now - ABANDONED_BATCH_SECONDS
+        def work(conn):
+            expired = "SELECT batch_id FROM batches WHERE sealed_at < ? OR (sealed_at IS NULL AND start_time < ?)"
+            conn.execute(f"DELETE FROM tests WHERE batch_id IN ({expired})", (cutoff, abandoned))
+            conn.execute(f"DELETE FROM changes WHERE batch_id IN ({expired})", (cutoff, abandoned))
+            conn.execute("DELETE FROM batches WHERE sealed_at < ? OR (sealed_at IS NULL AND start_time < ?)", (cutoff, abandoned))
+            conn.execute("DELETE FROM tests WHERE batch_id IS NULL AND created_at < ?", (cutoff,))
+        self._write(work)
+
+def gevent_wait_callback(conn, timeout=None):
+    """Let psycopg2 yield to other greenlets while it waits on the server, instead of blocking the worker."""
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        if state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+class PostgresConnection:
+    """A pooled psycopg2 connection with the slice of the sqlite3 interface the registry and rate buckets use."""
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        cursor = self._conn.cursor()
+        cursor.execute(sql.replace("?", "%s"), params)
+        return cursor
+
+    def close(self):
+        self._pool.release(self._conn)
+
+class PostgresPool:
+    """Per-process psycopg2 pool that waits for a free connection instead of raising PoolError."""
+    SCHEMA_LOCK = 0x534D53  # advisory lock serializing CREATE TABLE IF NOT EXISTS across starting workers
+
+    def __init__(self, dsn=STATE_DATABASE_URL, size=STATE_DB_POOL_SIZE):
+        if psycopg2 is None:
+            raise RuntimeError("STATE_BACKEND=postgres needs psycopg2: pip install psycopg2-binary")
+        if not dsn:
+            raise RuntimeError("STATE_BACKEND=postgres needs STATE_DATABASE_URL")
+        gevent_monkey = sys.modules.get("gevent.monkey")
+        if gevent_monkey and gevent_monkey.is_module_patched("socket"):
+            psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+        self.dsn = dsn
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, size, dsn)
+        self._free = threading.BoundedSemaphore(size)
+
+    def connect(self):
+        self._free.acquire()
+        try:
+            conn = self._pool.getconn()
+            conn.autocommit = True  # transactions are explicit BEGIN/COMMIT, as with the sqlite3 connections
+        except BaseException:
+            self._free.release()
+            raise
+        return PostgresConnection(self, conn)
+
+    def release(self, conn):
+        self._pool.putconn(conn, close=bool(conn.closed))
+        self._free.release()
+
+    def create_schema(self, ddl):
+        with closing(self.connect()) as conn:
+            conn.execute("BEGIN")
+            try:
+                conn.execute("SELECT pg_advisory_xact_lock(?)", (self.SCHEMA_LOCK,))
+                conn.execute(ddl)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+@cache
+def postgres_pool():
+    return PostgresPool()
+
+class PostgresTestRegistry(SQLiteTestRegistry):
+    """Registry shared by every worker of every instance through one Postgres database.
+
+    Same tables and transactions as the SQLite registry, with row locks in place of SQLite's database lock. Each
+    write sends a NOTIFY on commit, and a listener thread per process wakes local waiters as soon as any instance
+    changes a batch, so STATE_POLL_INTERVAL is only a fallback for a dropped listener connection.
+    """
+    SCHEMA = SQLiteTestRegistry.SCHEMA.replace(" REAL", " DOUBLE PRECISION")
+    BEGIN = "BEGIN"
+    FOR_UPDATE = " FOR UPDATE"
+    CHANNEL = "sms_test_registry"
+
+    def __init__(self, ttl=TEST_TTL_SECONDS, poll_interval=STATE_POLL_INTERVAL):
+        TestRegistry.__init__(self, ttl)
+        self.poll_interval = poll_interval
+        self._changed = threading.Condition()
+        self._pool = postgres_pool()
+        self._pool.create_schema(self.SCHEMA)
+        threading.Thread(target=self._listen, daemon=True, name="test-registry-listener").start()
+
+    def _connect(self):
+        return self._pool.connect()
+
+    def _write(self, work):
+        def notify(conn):
+            result = work(conn)
+            conn.execute(f"NOTIFY {self.CHANNEL}")  # delivered only if the transaction commits
+            return result
+        return super()._write(notify)
+
+    def _listen(self):
+        """Wake local waiters whenever any instance commits a change, reconnecting if the connection drops."""
+        while True:
+            try:
+                with closing(psycopg2.connect(self._pool.dsn)) as conn:
+                    conn.autocommit = True
+                    conn.cursor().execute(f"LISTEN {self.CHANNEL}")
+                    while True:
+                        if select.select([conn], [], [], self.poll_interval)[0]:
+                            conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            with self._changed:
+                                self._changed.notify_all()
+            except psycopg2.Error as e:
+                print(f"Test registry listener lost its connection: {e}", file=sys.stderr)
+                time.sleep(self.poll_interval)
+
+def create_test_registry():
+    if STATE_BACKEND == "postgres":
+        return PostgresTestRegistry()
+    if STATE_BACKEND == "sqlite":
+        return SQLiteTestRegistry()
+    return InMemoryTestRegistry()
+
+# --- METRICS ---
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DLR_BUCKETS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120)
+METRIC_DEFINITIONS = {
+    "sms_send_queue_wait_seconds": ("histogram", "Time a message waited for a sender worker and its rate limit.", REQUEST_BUCKETS),
+    "sms_api_post_seconds": ("histogram", "Duration of the Messaging API POST.", REQUEST_BUCKETS),
+    "sms_api_requests_total": ("counter", "Messaging API POSTs by sender and HTTP status.", None),
+    "sms_webhook_requests_total": ("counter", "Webhook requests received.", None),
+    "sms_webhook_events_total": ("counter", "Webhook events received, by event type.", None),
+    "sms_webhook_unknown_tag_total": ("counter", "Webhook events whose tag matched no in-flight test.", None),
+    "sms_webhook_events_per_request": ("histogram", "Events carried by each webhook request.", (1, 2, 5, 10, 25, 50, 100, 250)),
+    "sms_webhook_processing_seconds": ("histogram", "Time spent handling a webhook request.", REQUEST_BUCKETS),
+    "sms_dlr_latency_seconds": ("histogram", "DLR latency per leg (leg1: sent to carrier, leg2: carrier to handset, total).", DLR_BUCKETS),
+    "sms_tests_finished_total": ("counter", "Finished tests by outcome.", None),
+}
+
+class Metrics:
+    """Prometheus counters and histograms whose hot path is one deque.append, which is atomic under the GIL.
+
+    Pending samples are folded into the totals when /metrics is scraped, or by whichever caller first finds the
+    backlog above FOLD_THRESHOLD and wins a non-blocking try-lock, so recording never waits on a lock.
+    """
+    FOLD_THRESHOLD = 10000
+
+    def __init__(self, definitions=METRIC_DEFINITIONS):
+        self.definitions = definitions
+        self._pending = deque()
+        self._fold_lock = threading.Lock()
+        self._values = {}  # (name, labels) -> counter value, or [bucket counts..., sum, count] for histograms
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        self._pending.append((name, tuple(sorted(labels.items())), value))
+        if len(self._pending) > self.FOLD_THRESHOLD: self._try_fold()
+
+    observe = inc  # histograms and counters share the queue; the fold step tells them apart by definition
+
+    def gauge(self, name, help_text, read):
+        """Register a gauge whose value is read by `read()` at scrape time."""
+        self._gauges[name] = (help_text, read)
+
+    def _try_fold(self):
+        if self._fold_lock.acquire(blocking=False):
+            try: self._fold()
+            finally: self._fold_lock.release()
+
+    def _fold(self):
+        pending, values = self._pending, self._values
+        while pending:
+            name, labels, value = pending.popleft()
+            kind, _, buckets = self.definitions[name]
+            if kind == "counter":
+                values[(name, labels)] = values.get((name, labels), 0) + value
+                continue
+            state = values.get((name, labels))
+            if state is None:
+                state = values[(name, labels)] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs: return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in pairs) + "}"
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._fold_lock:
+            self._fold()
+            snapshot = {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+        lines = []
+        for name, (kind, help_text, buckets) in self.definitions.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (metric, labels), value in sorted(snapshot.items()):
+                if metric != name: continue
+                if kind == "counter":
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {value[-1]}")
+                lines.append(f"{name}_sum{self._labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{self._labels(labels)} {value[-1]}")
+        for name, (help_text, read) in self._gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+# Label values must come from a fixed set: /webhook is unauthenticated and campaign files carry free-form carrier names,
+# and every distinct value would otherwise become a series that lives for the life of the process.
+WEBHOOK_EVENT_TYPES = ("message-sending", "message-delivered", "message-failed")
+METRIC_CARRIERS = set(CARRIER_LIMITS) | set(DESTINATION_CARRIERS.values())
+
+def metric_label(value, allowed):
+    return value if value in allowed else "other"
+
+def record_finished_metrics(test):
+    outcome = outcome_for(test.status)
+    labels = {"sender": test.from_name, "carrier": metric_label(test.carrier_name, METRIC_CARRIERS), "type": test.type}
+    metrics.inc("sms_tests_finished_total", outcome=outcome, **labels)
+    if outcome == "delivered":
+        for leg, seconds in zip(("leg1", "leg2", "total"), latency_legs(test)):
+            if seconds is not None:
+                metrics.observe("sms_dlr_latency_seconds", seconds, leg=leg, **labels)
+
+# --- OUTBOUND MESSAGE DISPATCH ---
+class TokenBucket:
+    """Blocking token bucket that paces one sender to `rate` messages per second."""
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class SQLiteTokenBucket:
+    """Token bucket kept in the shared state database, so every gunicorn worker on the host draws from one budget.
+
+    Uses the monotonic clock, which is system-wide, so all processes agree on the refill timeline.
+    """
+    SCHEMA = "CREATE TABLE IF NOT EXISTS rate_buckets (sender TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+    BEGIN = "BEGIN IMMEDIATE"
+    FOR_UPDATE = ""
+
+    def __init__(self, sender, rate, burst=None, path=STATE_DB_PATH):
+        self.sender = sender
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.path = path
+        with closing(sqlite3.connect(path, timeout=30)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(self.SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _now(self, conn):
+        return time.monotonic()
+
+    def _take(self):
+        """Take a token if one is available; returns 0, or the seconds until the next one."""
+        with closing(self._connect()) as conn:
+            conn.execute(self.BEGIN)
+            try:
+                row = conn.execute(f"SELECT tokens, updated FROM rate_buckets WHERE sender = ?{self.FOR_UPDATE}", (self.sender,)).fetchone()
+                now = self._now(conn)  # read once the row is locked, so no other writer can be ahead of it
+                tokens = self.capacity if row is None or row[1] > now else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+                conn.execute("INSERT INTO rate_buckets VALUES (?, ?, ?) ON CONFLICT (sender) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                             (self.sender, tokens - 1 if wait == 0 else tokens, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self):
+        while wait := self._take():
+            time.sleep(wait)
+
+class PostgresTokenBucket(SQLiteTokenBucket):
+    """Token bucket in the Postgres state database, shared by every worker of every instance.
+
+    Refills on the database server's clock, since the instances' own clocks can't be compared.
+    """
+    SCHEMA = SQLiteTokenBucket.SCHEMA.replace(" REAL", " DOUBLE PRECISION")
+    BEGIN = "BEGIN"
+    FOR_UPDATE = " FOR UPDATE"
+
+    def __init__(self, sender, rate, burst=None):
+        self.sender = sender
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._pool = postgres_pool()
+        self._pool.create_schema(self.SCHEMA)
+
+    def _connect(self):
+        return self._pool.connect()
+
+    def _now(self, conn):
+        return conn.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp())::DOUBLE PRECISION").fetchone()[0]
+
+def create_rate_bucket(sender, rate):
+    if STATE_BACKEND == "postgres":
+        return PostgresTokenBucket(sender, rate)
+    if STATE_BACKEND == "sqlite":
+        return SQLiteTokenBucket(sender, rate)
+    return TokenBucket(rate)
+
+class MessageDispatcher:
+    """Bounded worker pool for outbound message submission, rate limited per sender type."""
+    def __init__(self, max_workers=SENDER_POOL_SIZE, rate_limits=SENDER_RATE_LIMITS, window=CAMPAIGN_WINDOW):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sender")
+        self._buckets = {sender: create_rate_bucket(sender, rate) for sender, rate in rate_limits.items() if rate > 0}
+        self._windows = {sender: threading.BoundedSemaphore(window) for sender in rate_limits}
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "completed": 0, "queue_depth": 0, "max_queue_depth": 0,
+                       "queue_wait_total": 0.0, "queue_wait_max": 0.0, "submit_latency_total": 0.0, "submit_latency_max": 0.0}
+
+    def submit(self, sender, fn, *args):
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["queue_depth"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._stats["queue_depth"])
+        return self._executor.submit(self._run, sender, time.monotonic(), fn, args)
+
+    def submit_paced(self, sender, fn, *args):
+        """Like submit, but blocks the caller while `sender` already has a full window queued or in flight.
+
+        Feeding a long campaign through this keeps the executor queue short, and stops a slow sender's backlog
+        from tying up workers that another sender could use.
+        """
+        window = self._windows.get(sender)
+        if window is None:
+            return self.submit(sender, fn, *args)
+        window.acquire()
+        future = self.submit(sender, fn, *args)
+        future.add_done_callback(lambda _: window.release())
+        return future
+
+    def _run(self, sender, enqueued_at, fn, args):
+        bucket = self._buckets.get(sender)
+        if bucket: bucket.acquire()
+        started_at = time.monotonic()
+        metrics.observe("sms_send_queue_wait_seconds", started_at - enqueued_at, sender=sender)
+        try:
+            return fn(*args)
+        finally:
+            finished_at = time.monotonic()
+            with self._lock:
+                stats = self._stats
+                stats["queue_depth"] -= 1
+                stats["completed"] += 1
+                stats["queue_wait_total"] += started_at - enqueued_at
+                stats["queue_wait_max"] = max(stats["queue_wait_max"], started_at - enqueued_at)
+                stats["submit_latency_total"] += finished_at - started_at
+                stats["submit_latency_max"] = max(stats["submit_latency_max"], finished_at - started_at)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats["completed"] or 1
+        stats["queue_wait_avg"] = stats["queue_wait_total"] / completed
+        stats["submit_latency_avg"] = stats["submit_latency_total"] / completed
+        stats["rate_limits"] = {sender: bucket.rate for sender, bucket in self._buckets.items()}
+        return stats
+
+# --- CAMPAIGNS ---
+E164_NUMBER = re.compile(r'\+\d{8,15}')
+NUMBER_COLUMNS = ("number", "to", "destination", "phone")
+
+def campaign_destination(number, carrier, where):
+    """Return ((number, carrier), None) for a valid row, or (None, error)."""
+    number, carrier = str(number or "").strip(), " ".join(str(carrier or "").split())
+    if not E164_NUMBER.fullmatch(number):
+        return None, f"{where}: '{number[:20]}' is not an E.164 number"
+    if len(carrier) > CAMPAIGN_CARRIER_MAX_LENGTH:
+        return None, f"{where}: carrier label is longer than {CAMPAIGN_CARRIER_MAX_LENGTH} characters"
+    return (number, carrier or DESTINATION_CARRIERS.get(number, "N/A")), None
+
+def read_destinations(path, fmt):
+    """Yield (destination, error) per row of an uploaded CSV or JSONL file, one line at a time, then delete the file.
+
+    CSV rows are `number[,carrier]`, with an optional header naming the columns; JSONL lines are objects with
+    `number` (or `to`) and an optional `carrier`.
+    """
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            if fmt == "jsonl":
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip(): continue
+                    try:
+                        item = json.loads(line)
+                        yield campaign_destination(item.get("number") or item.get("to"), item.get("carrier"), f"line {line_no}")
+                    except (ValueError, AttributeError):
+                        yield None, f"line {line_no}: not a JSON object"
+                return
+            number_col, carrier_col = 0, 1
+            for row_no, row in enumerate(csv.reader(f), 1):
+                if not any(cell.strip() for cell in row): continue
+                if row_no == 1 and not E164_NUMBER.fullmatch(row[0].strip()):
+                    header = [cell.strip().lower() for cell in row]
+                    if any(name in header for name in NUMBER_COLUMNS):
+                        number_col = next(header.index(name) for name in NUMBER_COLUMNS if name in header)
+                        carrier_col = header.index("carrier") if "carrier" in header else None
+                        continue
+                number = row[number_col] if number_col < len(row) else ""
+                carrier = row[carrier_col] if carrier_col is not None and carrier_col < len(row) else None
+                yield campaign_destination(number, carrier, f"row {row_no}")
+    except UnicodeDecodeError:
+        yield None, "the file is not UTF-8 text"
+    finally:
+        os.unlink(path)
+
+def run_campaign(batch_id, destinations, senders, message_types, text=None, max_destinations=CAMPAIGN_MAX_DESTINATIONS):
+    """Add and dispatch one test per destination, sender and message type, then seal the batch.
+
+    Runs on a background thread. Paced submission holds it back whenever a sender's window is full, so only
+    the rows being sent are ever in memory and each sender is paced by its own token bucket.
+    """
+    added, skipped, errors = 0, 0, []
+    try:
+        with closing(destinations):
+            for index, (destination, error) in enumerate(destinations):
+                if index >= max_destinations:
+                    errors.append(f"Only the first {max_destinations} destinations were used.")
+                    break
+                if error:
+                    skipped += 1
+                    if len(errors) < 20: errors.append(error)
+                    continue
+                number, carrier = destination
+                for from_data in senders:
+                    for msg_type in message_types:
+                        test_id = f"bulk_{time.time()}_{added}"
+                        added += 1
+                        test_registry.add(TestRecord(test_id, batch_id=batch_id, from_name=from_data["name"], from_num=from_data["number"],
+                                                     to_num=number, carrier_name=carrier, type=msg_type.upper()))
+                        args = (from_data["number"], from_data["appId"], number, msg_type, text or f"{from_data['name']} {msg_type.upper()} Test", test_id)
+                        dispatcher.submit_paced(from_data["name"], send_message, *args)
+    except Exception as e:
+        errors.append(f"Campaign stopped early: {e}")
+    finally:
+        test_registry.seal_batch(batch_id, skipped, errors)
+
+def start_campaign(batch_id, destinations, senders, message_types, text=None):
+    test_registry.create_batch(batch_id, sealed=False)
+    threading.Thread(target=run_campaign, args=(batch_id, destinations, senders, message_types, text),
+                     daemon=True, name=f"campaign-{batch_id}").start()
+
+def campaign_report(progress):
+    """Turn a batch's incremental summary into per-group rows with outcome counts and latency percentiles."""
+    groups = []
+    for key, group in sorted(progress["summary"].get("groups", {}).items()):
+        type_name, sender, carrier = key.split("|", 2)
+        groups.append({"type": type_name, "sender": sender, "carrier": carrier,
+                       **summarize_group(group["outcomes"], {"total": group["bins"]} if group["bins"] else {})})
+    report = {key: value for key, value in progress.items() if key != "summary"}
+    report["groups"] = groups
+    return report
+
+# --- LATENCY HISTORY ---
+def outcome_for(status):
+    if status == "Delivered": return "delivered"
+    if status.startswith("Failed"): return "failed"
+    if status == "Timed Out": return "timed_out"
+    return "error"
+
+def summarize_group(outcomes, bins):
+    """Counts, failure rate and per-metric p50/p95/p99 for one report group; `bins` maps metric -> latency bins."""
+    count = sum(outcomes.values())
+    return {"count": count, "delivered": outcomes.get("delivered", 0), "failed": outcomes.get("failed", 0),
+            "timed_out": outcomes.get("timed_out", 0), "errors": outcomes.get("error", 0),
+            "failure_rate": round((count - outcomes.get("delivered", 0)) / count, 4) if count else None,
+            "latency": {metric: LatencyHistory.quantiles(metric_bins) for metric, metric_bins in bins.items()}}
+
+def parse_duration(value):
+    """Parse '6h', '24h' or '7d' into seconds; only whole hours and days, the latency history's granularity."""
+    match = re.fullmatch(r'(\d+)\s*([hd])', (value or "").strip().lower())
+    if not match:
+        raise ValueError(f"Invalid duration '{value}'; use whole hours or days, e.g. 6h, 24h or 7d.")
+    return int(match.group(1)) * {"h": 3600, "d": 86400}[match.group(2)]
+
+class LatencyHistory:
+    """On-disk log of finished tests plus hourly, log-bucketed latency histograms.
+
+    Each latency lands in bucket ceil(log_gamma(seconds)), so any percentile read back from the buckets is
+    within ~1% of the true value and a query only sums bucket counts, however many raw rows have been logged.
+    Writes are queued and flushed by a background thread to keep them off the webhook path.
+    """
+    GAMMA = 1.02
+    METRICS = ("leg1", "leg2", "total")
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS latency_results (id INTEGER PRIMARY KEY, recorded_at REAL, test_id TEXT, message_id TEXT,
+                                                    sender TEXT, carrier TEXT, msg_type TEXT, leg1 REAL, leg2 REAL, total REAL, status TEXT);
+        CREATE TABLE IF NOT EXISTS latency_buckets (hour INTEGER, sender TEXT, carrier TEXT, msg_type TEXT, metric TEXT, bin INTEGER, count INTEGER,
+                                                    PRIMARY KEY (hour, sender, carrier, msg_type, metric, bin));
+        CREATE TABLE IF NOT EXISTS latency_outcomes (hour INTEGER, sender TEXT, carrier TEXT, msg_type TEXT, outcome TEXT, count INTEGER,
+                                                     PRIMARY KEY (hour, sender, carrier, msg_type, outcome));
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._queue = queue.Queue()
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+        threading.Thread(target=self._writer, daemon=True, name="latency-history-writer").start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, test):
+        self._queue.put((time.time(), test))
+
+    @classmethod
+    def bin_index(cls, seconds):
+        return math.ceil(math.log(max(seconds, 0.001)) / math.log(cls.GAMMA))
+
+    @classmethod
+    def bin_value(cls, index):
+        return 2 * cls.GAMMA ** index / (cls.GAMMA + 1)
+
+    def _writer(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < 500:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(items)
+            except sqlite3.Error as e:
+                print(f"Latency history write failed: {e}", file=sys.stderr)
+
+    def _write(self, items):
+        with closing(self._connect()) as conn, conn:
+            for recorded_at, test in items:
+                legs = dict(zip(self.METRICS, latency_legs(test)))
+                if legs["total"] is None and test.latency is not None:
+                    legs["total"] = test.latency
+                dims = (test.from_name, test.carrier_name, test.type)
+                hour = int(recorded_at // 3600)
+                conn.execute("INSERT INTO latency_results (recorded_at, test_id, message_id, sender, carrier, msg_type, leg1, leg2, total, status) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (recorded_at, test.test_id, test.message_id, *dims, *legs.values(), test.status))
+                conn.execute("INSERT INTO latency_outcomes VALUES (?, ?, ?, ?, ?, 1) ON CONFLICT DO UPDATE SET count = count + 1",
+                             (hour, *dims, outcome_for(test.status)))
+                for metric, seconds in legs.items():
+                    if seconds is not None:
+                        conn.execute("INSERT INTO latency_buckets VALUES (?, ?, ?, ?, ?, ?, 1) ON CONFLICT DO UPDATE SET count = count + 1",
+                                     (hour, *dims, metric, self.bin_index(seconds)))
+
+    @classmethod
+    def quantiles(cls, bins, quantiles=(0.5, 0.95, 0.99)):
+        total = sum(bins.values())
+        ordered, results, seen = sorted((int(index), count) for index, count in bins.items()), {}, 0
+        for q in quantiles:
+            rank = max(1, math.ceil(q * total))
+            for index, count in ordered:
+                seen += count
+                if seen >= rank:
+                    results[f"p{round(q * 100)}"] = round(cls.bin_value(index), 3)
+                    break
+            seen = 0
+        return results
+
+    def query(self, window, interval=None, sender=None, carrier=None, msg_type=None):
+        """Aggregate finished tests over the last `window` seconds, optionally split into `interval`-second periods.
+
+        Both must be whole hours, the bucket size (ValueError otherwise); the window starts at the top of its first hour.
+        Returns one entry per (period, sender, carrier, type) with counts, failure rate and p50/p95/p99 per latency leg.
+        """
+        for name, seconds in (("window", window), ("interval", interval)):
+            if seconds is not None and (seconds < 3600 or seconds % 3600):
+                raise ValueError(f"The {name} must be a whole number of hours (latency history is kept in hourly buckets).")
+        start_hour = int((time.time() - window) // 3600)
+        period_hours = interval // 3600 if interval else 1 << 40
+        where, params = ["hour >= ?"], [start_hour]
+        for column, value in (("sender", sender), ("carrier", carrier), ("msg_type", msg_type)):
+            if value:
+                where.append(f"{column} = ?"); params.append(value)
+        where = " AND ".join(where)
+        groups = {}
+        with closing(self._connect()) as conn:
+            for period, *dims, outcome, count in conn.execute(
+                    f"SELECT hour / ?, sender, carrier, msg_type, outcome, SUM(count) FROM latency_outcomes WHERE {where} GROUP BY 1, 2, 3, 4, 5",
+                    (period_hours, *params)):
+                group = groups.setdefault((period, *dims), {"outcomes": {}, "bins": {}})
+                group["outcomes"][outcome] = count
+            for period, *dims, metric, index, count in conn.execute(
+                    f"SELECT hour / ?, sender, carrier, msg_type, metric, bin, SUM(count) FROM latency_buckets WHERE {where} GROUP BY 1, 2, 3, 4, 5, 6",
+                    (period_hours, *params)):
+                group = groups.setdefault((period, *dims), {"outcomes": {}, "bins": {}})
+                group["bins"].setdefault(metric, {})[index] = count
+        results = []
+        for (period, sender_name, carrier_name, type_name), group in sorted(groups.items()):
+            entry = {"sender": sender_name, "carrier": carrier_name, "type": type_name, **summarize_group(group["outcomes"], group["bins"])}
+            if interval:
+                entry["period_start"] = datetime.fromtimestamp(max(period * period_hours, start_hour) * 3600).isoformat()
+            results.append(entry)
+        return results
+
+# --- MEDIA ANALYSIS ---
+@dataclass(slots=True)
+class CachedUrl:
+    key: tuple
+    etag: str | None
+    last_modified: str | None
+    stored_at: float
+
+class AnalysisCache:
+    """LRU cache of media analysis results with size- and TTL-based eviction.
+
+    Results are keyed by (sha256 of the media bytes, Content-Type), so the same creative hosted at several URLs
+    is only decoded and OCR'd once. A URL index remembers which result each URL served and its ETag/Last-Modified
+    validators, letting a repeat lookup revalidate with a conditional GET instead of downloading the media again.
+    A URL served without validators is downloaded every time; only its decode and OCR are skipped when the bytes
+    hash to a cached result.
+    """
+    URL_ENTRY_BYTES = 256
+
+    def __init__(self, max_bytes=ANALYSIS_CACHE_MAX_BYTES, ttl=ANALYSIS_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._urls = OrderedDict()
+        self._results = OrderedDict()
+        self._bytes = 0
+
+    def _fresh(self, stored_at):
+        return time.time() - stored_at < self.ttl
+
+    def lookup_url(self, url):
+        """Return (CachedUrl, result) for a URL whose result is still cached, else None."""
+        with self._lock:
+            entry = self._urls.get(url)
+            if entry is None or not self._fresh(entry.stored_at) or entry.key not in self._results:
+                return None
+            self._urls.move_to_end(url)
+            self._results.move_to_end(entry.key)
+            return entry, self._results[entry.key][0]
+
+    def lookup_result(self, key):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is None or not self._fresh(cached[2]):
+                return None
+            self._results.move_to_end(key)
+            return cached[0]
+
+    def touch_url(self, url):
+        with self._lock:
+            entry = self._urls.get(url)
+            if entry:
+                entry.stored_at = time.time()
+                if entry.key in self._results:
+                    result, size, _ = self._results[entry.key]
+                    self._results[entry.key] = (result, size, entry.stored_at)
+
+    def store(self, url, key, etag, last_modified, result):
+        now = time.time()
+        with self._lock:
+            if url not in self._urls:
+                self._bytes += len(url) + self.URL_ENTRY_BYTES
+            self._urls[url] = CachedUrl(key, etag, last_modified, now)
+            self._urls.move_to_end(url)
+            if key in self._results:
+                self._bytes -= self._results[key][1]
+            size = len(json.dumps(result))
+            self._results[key] = (result, size, now)
+            self._results.move_to_end(key)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._results:
+            _, (_, size, _) = self._results.popitem(last=False)
+            self._bytes -= size
+        while self._bytes > self.max_bytes and self._urls:
+            url, _ = self._urls.popitem(last=False)
+            self._bytes -= len(url) + self.URL_ENTRY_BYTES
+
+class OcrPool:
+    """Runs OCR in at most `workers` separate processes so tesseract never blocks the web worker.
+
+    Each job runs `python -m ocr_worker` through subprocess, which gevent makes cooperative, so waiting on OCR
+    doesn't stall webhook handling. Jobs beyond `queue_limit` (running plus waiting) are skipped outright; batch
+    jobs draw from a separate `batch_queue_limit` shared by every bulk analysis.
+    """
+    STARTUP_SLACK_SECONDS = 5
+
+    def __init__(self, workers=OCR_WORKERS, queue_limit=OCR_QUEUE_LIMIT, timeout=OCR_TIMEOUT_SECONDS,
+                 batch_queue_limit=OCR_BATCH_QUEUE_LIMIT, batch_wait=OCR_BATCH_WAIT_SECONDS):
+        self.timeout = timeout
+        self.batch_wait = batch_wait
+        self._workers = threading.BoundedSemaphore(workers)
+        self._slots = threading.BoundedSemaphore(max(queue_limit, workers))
+        self._batch_slots = threading.BoundedSemaphore(max(batch_queue_limit, 1))
+
+    def extract_text(self, content, wait=False):
+        """Return (text, None), or (None, reason) where reason is 'busy', 'timeout' or 'error'.
+
+        'busy' means OCR never started: the queue was full, or no worker freed up in time. With `wait`, the job
+        waits up to `batch_wait` seconds for a batch slot and a worker instead of `timeout` for a worker alone.
+        """
+        if wait:
+            slots, deadline = self._batch_slots, time.monotonic() + self.batch_wait
+            if not slots.acquire(timeout=self.batch_wait):
+                return None, "busy"
+        else:
+            slots, deadline = self._slots, time.monotonic() + self.timeout
+            if not slots.acquire(blocking=False):
+                return None, "busy"
+        try:
+            if not self._workers.acquire(timeout=max(0, deadline - time.monotonic())):
+                return None, "busy"
+            try:
+                # tesseract is killed after `timeout` inside the worker; the slack covers interpreter start-up
+                result = subprocess.run([sys.executable, "-m", "ocr_worker", str(OCR_MAX_DIMENSION), str(self.timeout)],
+                                        input=content, capture_output=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        timeout=self.timeout + self.STARTUP_SLACK_SECONDS)
+            finally:
+                self._workers.release()
+        except subprocess.TimeoutExpired:
+            return None, "timeout"
+        except OSError:
+            return None, "error"
+        finally:
+            slots.release()
+        if result.returncode == ocr_worker.TIMEOUT_EXIT_CODE:
+            return None, "timeout"
+        if result.returncode != 0:
+            return None, "error"
+        return result.stdout.decode("utf-8", errors="replace"), None
+
+def analyze_media(media_url, wait_for_ocr=False):
+    """Return the analysis report context for a URL, reusing cached results where the media is unchanged."""
+    cached = analysis_cache.lookup_url(media_url)
+    headers = {}
+    if cached:
+        entry, result = cached
+        if entry.etag: headers["If-None-Match"] = entry.etag
+        if entry.last_modified: headers["If-Modified-Since"] = entry.last_modified
+    response, content, size, complete = fetch_media(media_url, headers)
+    if cached and response.status_code == 304:
+        analysis_cache.touch_url(media_url)
+        return result
+    content_type = response.headers.get('Content-Type', 'N/A')
+    key = (hashlib.sha256(content).hexdigest(), content_type, size)
+    result = analysis_cache.lookup_result(key) or check_media(content_type, content, size, complete, wait_for_ocr)
+    if result.get("cacheable", True):
+        analysis_cache.store(media_url, key, response.headers.get("ETag"), response.headers.get("Last-Modified"), result)
+    return result
+
+def fetch_media(media_url, headers=None):
+    """Stream a media URL without ever holding more than MEDIA_MAX_BYTES of it.
+
+    Returns (response, content, size, complete). `size` comes from Content-Length or the bytes read, and is None
+    when the body ran past the cap without declaring its length. If Content-Length already exceeds the cap, only
+    the first MEDIA_HEADER_BYTES are read.
+    """
+    with http_session.get(media_url, headers=headers, stream=True, allow_redirects=True, timeout=10) as response:
+        if response.status_code == 304:
+            return response, b"", None, False
+        response.raise_for_status()
+        declared = response.headers.get("Content-Length", "")
+        declared = int(declared) if declared.isdigit() else None
+        limit = MEDIA_HEADER_BYTES if declared and declared > MEDIA_MAX_BYTES else MEDIA_MAX_BYTES + 1
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            content += chunk
+            if len(content) >= limit:
+                break
+        complete = len(content) <= MEDIA_MAX_BYTES and not (declared and declared > MEDIA_MAX_BYTES)
+        if complete:
+            size = len(content)
+        else:
+            size = declared if declared and declared > MEDIA_MAX_BYTES else None
+        return response, bytes(content[:limit]), size, complete
+
+def analyze_media_batch(media_urls):
+    """Analyze URLs concurrently, yielding each report context (with its `url`) as soon as it finishes."""
+    executor = ThreadPoolExecutor(max_workers=max(1, min(ANALYSIS_CONCURRENCY, len(media_urls))), thread_name_prefix="analysis")
+    futures = {executor.submit(analyze_media, url, True): url for url in media_urls}
+    try:
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                yield {"url": url, **future.result()}
+            except requests.exceptions.RequestException as e:
+                yield {"url": url, "error": f"Could not connect to URL. Error: {e}"}
+            except Exception as e:
+                yield {"url": url, "error": f"Analysis failed: {e}"}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)  # stop queued work if the client goes away
+
+def check_media(content_type, content, size, complete, wait_for_ocr=False):
+    checks, spam_checks, analysis, show_preview = [], [], [], False
+    checks.append({"icon": "✅", "message": f"URL is accessible (Status Code: 200)."})
+    if any(t in content_type for t in ['image/jpeg', 'image/png', 'image/gif']):
+        checks.append({"icon": "✅", "message": f"Content-Type '{content_type}' is supported."}); show_preview = True
+    else:
+        checks.append({"icon": "⚠️", "message": f"Warning: Content-Type '{content_type}' may not be supported."})
+    if size is None:
+        size_in_kb = float("inf")
+        checks.append({"icon": "⚠️", "message": f"File size is over {MEDIA_MAX_BYTES // 1024} KB (download stopped early)."})
+    else:
+        size_in_kb = size / 1024
+        checks.append({"icon": "✅", "message": f"File size is {size_in_kb:.0f} KB."})
+    for carrier, limit in CARRIER_LIMITS.items():
+        status, note = ("OK", f"Within ~{limit}KB limit.") if size_in_kb <= limit else ("REJECT", f"Exceeds ~{limit}KB limit.")
+        analysis.append({"name": carrier, "status": status, "note": note})
+    if show_preview:
+        try:
+            img = Image.open(io.BytesIO(content)); width, height = img.size  # reads the header only; pixels are decoded lazily
+        except Exception:
+            spam_checks.append({"icon": "⚠️", "message": "Could not read image dimensions."})
+            return {"checks": checks, "spam_checks": spam_checks, "analysis": analysis, "show_preview": show_preview}
+        aspect_ratio = height / width if width > 0 else 0
+        spam_checks.append({"icon": "✅" if aspect_ratio <= 3 else "⚠️", "message": "Standard aspect ratio." if aspect_ratio <= 3 else "Image is very tall/thin, may increase spam risk."})
+        if not complete:
+            spam_checks.append({"icon": "⚠️", "message": "Image exceeds every carrier limit, so OCR text analysis was skipped."})
+            return {"checks": checks, "spam_checks": spam_checks, "analysis": analysis, "show_preview": show_preview}
+        text_in_image, ocr_failure = ocr_pool.extract_text(content, wait=wait_for_ocr)
+        if ocr_failure == "busy":
+            spam_checks.append({"icon": "⚠️", "message": "OCR skipped: the server is busy analyzing other images. Try again shortly."})
+        elif ocr_failure == "timeout":
+            spam_checks.append({"icon": "⚠️", "message": f"OCR timed out after {ocr_pool.timeout:.0f} seconds."})
+        elif ocr_failure:
+            spam_checks.append({"icon": "⚠️", "message": "Could not perform OCR text analysis."})
+        else:
+            spam_checks.append({"icon": "✅" if len(text_in_image.strip()) < 50 else "⚠️", "message": "Image is not primarily text-based." if len(text_in_image.strip()) < 50 else "Image contains significant text, increasing spam risk."})
+            if any(s in text_in_image for s in ['bit.ly', 't.co']):
+                spam_checks.append({"icon": "❌", "message": "Image text contains a URL shortener, a high spam risk."})
+            else:
+                spam_checks.append({"icon": "✅", "message": "No URL shorteners detected in image text."})
+        # A skipped, timed-out or failed OCR run (spawn errors, crashed workers) says more about load than the media, so don't cache it
+        return {"checks": checks, "spam_checks": spam_checks, "analysis": analysis, "show_preview": show_preview,
+                "cacheable": ocr_failure is None}
+    return {"checks": checks, "spam_checks": spam_checks, "analysis": analysis, "show_preview": show_preview}
 
 # --- GLOBAL VARIABLES & APP SETUP ---
-active_tests = {}
+metrics = Metrics()
+test_registry = create_test_registry()
+test_registry.start_reaper()
+latency_history = LatencyHistory()
+test_registry.finish_listeners.append(latency_history.record)
+test_registry.finish_listeners.append(record_finished_metrics)
+http_session = requests.Session()
+for scheme in ("https://", "http://"):
+    http_session.mount(scheme, HTTPAdapter(pool_connections=16, pool_maxsize=max(SENDER_POOL_SIZE, ANALYSIS_CONCURRENCY)))
+dispatcher = MessageDispatcher()
+metrics.gauge("sms_send_queue_depth", "Messages queued or in flight in the sender pool.", lambda: dispatcher.stats()["queue_depth"])
+analysis_cache = AnalysisCache()
+ocr_pool = OcrPool()
 app = Flask(__name__)
 
 # --- BASIC AUTHENTICATION ---
@@ -53,6 +1453,42 @@ def requires_auth(f):
     return decorated
 
 # --- HTML TEMPLATES & STYLES ---
+DASHBOARD_CSS = """
+body > main { padding: 2rem; max-width: 1200px; }
+.error { background-color: var(--pico-form-element-invalid-background-color); color: var(--pico-form-element-invalid-color); padding: 1rem; border-radius: var(--pico-border-radius); }
+.highlight { background-color: var(--pico-color-green-100); }
+.timeline { list-style-type: none; padding-left: 0; }
+.timeline li { padding-left: 2rem; border-left: 3px solid var(--pico-primary); position: relative; padding-bottom: 1.5rem; margin-left: 1rem; }
+.timeline li::before { content: '✓'; position: absolute; left: -12px; top: 0; background: var(--pico-primary); color: white; width: 24px; height: 24px; border-radius: 50%; text-align: center; line-height: 24px; }
+.sent { color: var(--pico-color-azure-600); }
+.loader { border: 4px solid #f3f3f3; border-top: 4px solid #3498db; border-radius: 50%; width: 30px; height: 30px; animation: spin 1s linear infinite; margin: 20px auto; }
+@keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
+pre { background-color: #f5f5f5; padding: 1rem; border-radius: var(--pico-border-radius); white-space: pre-wrap; word-wrap: break-word; }
+.grid-2 { display: grid; grid-template-columns: repeat(auto-fit, minmax(350px, 1fr)); grid-gap: 2rem; }
+section[role="tabpanel"] { display: none; padding: 1.5rem 0; border-top: 1px solid var(--pico-muted-border-color);}
+section[role="tabpanel"][aria-hidden="false"] { display: block; }
+[role="tab"] { font-weight: bold; }
+[role="tab"][aria-selected="true"] { background-color: var(--pico-primary-background); }
+"""
+DASHBOARD_JS = """
+const tabs = document.querySelectorAll('[role="tab"]');
+const tabPanels = document.querySelectorAll('[role="tabpanel"]');
+tabs.forEach(tab => {
+    tab.addEventListener('click', (e) => {
+        tabs.forEach(t => t.setAttribute('aria-selected', 'false'));
+        tabPanels.forEach(p => p.setAttribute('aria-hidden', 'true'));
+        const targetId = e.target.getAttribute('data-target');
+        e.target.setAttribute('aria-selected', 'true');
+        document.getElementById(targetId).setAttribute('aria-hidden', 'false');
+    });
+});
+// Activate first tab by default, or based on URL hash
+const hash = window.location.hash.substring(1);
+const targetTab = hash ? document.querySelector(`[data-target='${hash}']`) : tabs[0];
+if(targetTab) {
+    targetTab.click();
+}
+"""
 HTML_HEADER = """
 <!DOCTYPE html>
 <html lang="en" data-theme="light">
@@ -61,23 +1497,7 @@ HTML_HEADER = """
     <meta name="viewport" content="width=device-width, initial-scale=1">
     <title>Bandwidth Support Dashboard</title>
     <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/@picocss/pico@2/css/pico.min.css"/>
-    <style>
-        body > main { padding: 2rem; max-width: 1200px; }
-        .error { background-color: var(--pico-form-element-invalid-background-color); color: var(--pico-form-element-invalid-color); padding: 1rem; border-radius: var(--pico-border-radius); }
-        .highlight { background-color: var(--pico-color-green-100); }
-        .timeline { list-style-type: none; padding-left: 0; }
-        .timeline li { padding-left: 2rem; border-left: 3px solid var(--pico-primary); position: relative; padding-bottom: 1.5rem; margin-left: 1rem; }
-        .timeline li::before { content: '✓'; position: absolute; left: -12px; top: 0; background: var(--pico-primary); color: white; width: 24px; height: 24px; border-radius: 50%; text-align: center; line-height: 24px; }
-        .sent { color: var(--pico-color-azure-600); }
-        .loader { border: 4px solid #f3f3f3; border-top: 4px solid #3498db; border-radius: 50%; width: 30px; height: 30px; animation: spin 1s linear infinite; margin: 20px auto; }
-        @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
-        pre { background-color: #f5f5f5; padding: 1rem; border-radius: var(--pico-border-radius); white-space: pre-wrap; word-wrap: break-word; }
-        .grid-2 { display: grid; grid-template-columns: repeat(auto-fit, minmax(350px, 1fr)); grid-gap: 2rem; }
-        section[role="tabpanel"] { display: none; padding: 1.5rem 0; border-top: 1px solid var(--pico-muted-border-color);}
-        section[role="tabpanel"][aria-hidden="false"] { display: block; }
-        [role="tab"] { font-weight: bold; }
-        [role="tab"][aria-selected="true"] { background-color: var(--pico-primary-background); }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('dashboard.css') }}"/>
 </head>
 <body>
 <main class="container">
@@ -92,25 +1512,7 @@ HTML_NAVIGATION = """
 """
 HTML_FOOTER = """
 </main>
-<script>
-    const tabs = document.querySelectorAll('[role="tab"]');
-    const tabPanels = document.querySelectorAll('[role="tabpanel"]');
-    tabs.forEach(tab => {
-        tab.addEventListener('click', (e) => {
-            tabs.forEach(t => t.setAttribute('aria-selected', 'false'));
-            tabPanels.forEach(p => p.setAttribute('aria-hidden', 'true'));
-            const targetId = e.target.getAttribute('data-target');
-            e.target.setAttribute('aria-selected', 'true');
-            document.getElementById(targetId).setAttribute('aria-hidden', 'false');
-        });
-    });
-    // Activate first tab by default, or based on URL hash
-    const hash = window.location.hash.substring(1);
-    const targetTab = hash ? document.querySelector(`[data-target='${hash}']`) : tabs[0];
-    if(targetTab) {
-        targetTab.click();
-    }
-</script>
+<script src="{{ asset_url('dashboard.js') }}"></script>
 </body>
 </html>
 """
@@ -120,9 +1522,11 @@ HTML_DASHBOARD = HTML_HEADER + HTML_NAVIGATION + """
     </section>
     <section role="tabpanel" id="bulk-tester" aria-hidden="true">
         <article><h2>Bulk Performance Tester</h2><p>This tool will send an SMS and an MMS from both your Toll-Free and 10DLC numbers to the following destinations:</p>{% if numbers %}<ul>{% for number, name in numbers %}<li>{{ number }} {% if name %}({{ name }}){% endif %}</li>{% endfor %}</ul>{% else %}<p><em>No destination numbers configured.</em></p>{% endif %}<form action="/run_bulk_test" method="post"><button type="submit" {% if not numbers %}disabled{% endif %}>Start Performance Test</button></form></article>
+        <article><h2>Campaign Test</h2><p>Upload a CSV (<code>number,carrier</code>, header optional) or JSONL (<code>{"number": ..., "carrier": ...}</code>) file of up to {{ max_campaign_destinations }} destinations. Messages are paced per sender at {{ rate_limits.TF|int }}/s (Toll-Free) and {{ rate_limits['10DLC']|int }}/s (10DLC).</p><form action="/run_campaign" method="post" enctype="multipart/form-data"><label for="destinations_file">Destinations File</label><input type="file" id="destinations_file" name="destinations_file" accept=".csv,.jsonl,.ndjson,.txt" required><fieldset><legend>Senders</legend><label for="campaign_tf"><input type="checkbox" id="campaign_tf" name="senders" value="TF" checked> Toll-Free</label><label for="campaign_10dlc"><input type="checkbox" id="campaign_10dlc" name="senders" value="10DLC" checked> 10DLC</label></fieldset><fieldset><legend>Message Types</legend><label for="campaign_sms"><input type="checkbox" id="campaign_sms" name="message_types" value="sms" checked> SMS</label><label for="campaign_mms"><input type="checkbox" id="campaign_mms" name="message_types" value="mms"> MMS</label></fieldset><label for="campaign_text">Text Message</label><input type="text" id="campaign_text" name="message_text" placeholder="Optional; defaults to the sender and message type"><button type="submit">Start Campaign</button></form></article>
     </section>
     <section role="tabpanel" id="mms-analyzer" aria-hidden="true">
         <article><h2>MMS Media Analysis Tool</h2><p>Enter a media URL to check its technical details and compare against carrier limits.</p><form action="/run_analysis" method="post"><label for="media_url">Media URL</label><input type="text" id="media_url" name="media_url" placeholder="https://.../image.png" required><button type="submit">Analyze Media</button></form></article>
+        <article><h2>Batch Media Analysis</h2><p>Paste up to {{ max_batch_urls }} media URLs, one per line. Results appear as each URL finishes.</p><form action="/run_batch_analysis" method="post"><label for="media_urls">Media URLs</label><textarea id="media_urls" name="media_urls" rows="8" placeholder="https://.../image1.png&#10;https://.../image2.jpg" required></textarea><button type="submit">Analyze All</button></form></article>
     </section>
 """ + HTML_FOOTER
 HTML_DLR_RESULT = HTML_HEADER + """
@@ -130,23 +1534,38 @@ HTML_DLR_RESULT = HTML_HEADER + """
         <h2>Test Result</h2>
         {% if error %}<p class="error"><strong>Error:</strong><br>{{ error }}</p>
         {% elif status == 'sent' %}<h3 class="sent">✅ MMS Sent Successfully!</h3><p><strong>Message ID:</strong> {{ message_id }}</p><hr><p><strong>Note:</strong> A 'message-delivered' report was not received within the 60-second timeout.</p>
-        {% else %}<h3>DLR Timeline</h3><ul class="timeline"><li><strong>Message Sent to API</strong><br>Timestamp: {{ events.get('sent_str', 'N/A') }}</li>{% if events.sending %}<li><strong>Sent to Carrier</strong> (Leg 1 Latency: {{ "%.2f"|format(events.sending_latency) }}s)<br>Timestamp: {{ events.get('sending_str', 'N/A') }}</li>{% endif %}{% if events.delivered %}<li><strong>Delivered to Handset</strong> (Leg 2 Latency: {{ "%.2f"|format(events.delivered_latency) }}s)<br>Timestamp: {{ events.get('delivered_str', 'N/A') }}</li>{% endif %}</ul><hr><h4>Total End-to-End Latency: {{ "%.2f"|format(events.total_latency) }} seconds</h4><p><strong>Message ID:</strong> {{ message_id }}</p>{% endif %}<br><a href="/" role="button" class="secondary">Back to Dashboard</a>
+        {% else %}<h3>DLR Timeline</h3><ul class="timeline"><li><strong>Message Sent to API</strong><br>Timestamp: {{ events.get('sent_str', 'N/A') }}</li>{% if events.sending %}<li><strong>Sent to Carrier</strong> (Leg 1 Latency: {{ "%.2f"|format(events.sending_latency) }}s)<br>Timestamp: {{ events.get('sending_str', 'N/A') }}</li>{% endif %}{% if events.delivered %}<li><strong>Delivered to Handset</strong> (Leg 2 Latency: {{ "%.2f"|format(events.delivered_latency) }}s)<br>Timestamp: {{ events.get('delivered_str', 'N/A') }}</li>{% endif %}</ul><hr><h4>Total End-to-End Latency: {{ "%.2f"|format(events.total_latency) }} seconds</h4><p><small>Measured from Bandwidth's timestamps. Clock skew (ours - Bandwidth's): {{ "%.0f ms"|format(clock.skew * 1000) if clock.skew is not none else 'N/A' }} · Local overhead: {{ "%.0f ms"|format(clock.overhead * 1000) if clock.overhead is not none else 'N/A' }} · API round trip: {{ "%.0f ms"|format(clock.api_rtt * 1000) if clock.api_rtt is not none else 'N/A' }}</small></p><p><strong>Message ID:</strong> {{ message_id }}</p>{% endif %}<br><a href="/" role="button" class="secondary">Back to Dashboard</a>
     </article>
 """ + HTML_FOOTER
+HTML_DLR_PENDING = HTML_HEADER + """
+    <article><hgroup><h2>Test Result</h2><p id="status-text">Waiting for delivery receipt (up to {{ timeout }} seconds)...</p></hgroup><div class="loader"></div><a href="/" role="button" class="secondary">Back to Dashboard</a></article>
+    <script>
+        const interval = setInterval(() => {
+            fetch('/api/test_status/{{ test_id }}').then(response => response.json()).then(data => {
+                document.getElementById('status-text').innerText = `Status: ${data.status}`;
+                if (data.is_complete) { clearInterval(interval); window.location.reload(); }
+            });
+        }, 1000);
+    </script>
+""" + HTML_FOOTER
 HTML_BULK_RESULTS_PAGE = HTML_HEADER + """
     <article id="results-article"><hgroup><h2>Bulk Test Results</h2><p id="status-text">Tests in progress...</p></hgroup><div class="loader" id="loader"></div><div class="grid"><div id="sms-10dlc-results" style="display:none;"><h3>SMS Results (10DLC)</h3><figure><table id="sms-10dlc-table"></table></figure></div><div id="sms-tf-results" style="display:none;"><h3>SMS Results (Toll-Free)</h3><figure><table id="sms-tf-table"></table></figure></div></div><div class="grid"><div id="mms-10dlc-results" style="display:none;"><h3>MMS Results (10DLC)</h3><figure><table id="mms-10dlc-table"></table></figure></div><div id="mms-tf-results" style="display:none;"><h3>MMS Results (Toll-Free)</h3><figure><table id="mms-tf-table"></table></figure></div></div><br><a href="/" role="button" class="secondary">Back to Dashboard</a></article>
     <script>
         const batchId = '{{ batch_id }}';
+        const formatMs = (seconds) => seconds === null || seconds === undefined ? 'N/A' : (seconds * 1000).toFixed(0);
         function buildTable(data, tableId) {
             let table = document.getElementById(tableId);
-            table.innerHTML = `<thead><tr><th>To</th><th>Carrier</th><th>Status</th><th>Latency (s)</th></tr></thead>`;
+            table.innerHTML = `<thead><tr><th>To</th><th>Carrier</th><th>Status</th><th>Latency (s)</th><th>Skew / Overhead (ms)</th></tr></thead>`;
             let tbody = document.createElement('tbody');
             let bestLatency = Infinity;
             if (data.length > 0) { const delivered = data.filter(r => r.latency !== null); if (delivered.length > 0) { bestLatency = Math.min(...delivered.map(r => r.latency)); }}
             for (const row of data) {
                 let tr = document.createElement('tr');
                 if (row.latency === bestLatency) { tr.classList.add('highlight'); }
-                tr.innerHTML = `<td>${row.to_num}</td><td>${row.carrier_name}</td><td>${row.status}</td><td>${row.latency !== null ? row.latency.toFixed(2) : 'N/A'}</td>`;
+                // Carrier names come from uploaded campaign files, so every cell is set as text, never as HTML.
+                for (const value of [row.to_num, row.carrier_name, row.status, row.latency !== null ? row.latency.toFixed(2) : 'N/A', `${formatMs(row.clock_skew)} / ${formatMs(row.overhead)}`]) {
+                    tr.insertCell().textContent = value;
+                }
                 tbody.appendChild(tr);
             }
             table.appendChild(tbody);
@@ -155,18 +1574,84 @@ HTML_BULK_RESULTS_PAGE = HTML_HEADER + """
             const sections = {"sms-10dlc": data.sms.dlc, "sms-tf": data.sms.tf, "mms-10dlc": data.mms.dlc, "mms-tf": data.mms.tf};
             for (const key in sections) { if (sections[key].length > 0) { document.getElementById(key + '-results').style.display = 'block'; buildTable(sections[key], key + '-table'); }}
         }
-        const interval = setInterval(() => {
-            fetch(`/api/bulk_status/${batchId}`).then(response => response.json()).then(data => {
-                updateResults(data.results);
-                if (data.is_complete) {
-                    document.getElementById('loader').style.display = 'none';
-                    document.getElementById('status-text').innerText = 'All tests are complete.';
-                    clearInterval(interval);
+        function markComplete() {
+            document.getElementById('loader').style.display = 'none';
+            document.getElementById('status-text').innerText = 'All tests are complete.';
+        }
+        function pollResults() {
+            const interval = setInterval(() => {
+                fetch(`/api/bulk_status/${batchId}`).then(response => response.json()).then(data => {
+                    updateResults(data.results);
+                    if (data.is_complete) { markComplete(); clearInterval(interval); }
+                });
+            }, 3000);
+        }
+        if (window.EventSource) {
+            // Rows are keyed by test ID; each event only carries the tests that changed since the last one.
+            const rows = {};
+            const source = new EventSource(`/api/bulk_stream/${batchId}`);
+            source.addEventListener('update', (e) => {
+                const changed = new Set();
+                for (const row of JSON.parse(e.data)) { rows[row.test_id] = row; changed.add(row.type.toLowerCase() + '-' + (row.from_name === 'TF' ? 'tf' : '10dlc')); }
+                for (const key of changed) {
+                    const [msgType, numType] = key.split('-');
+                    const data = Object.values(rows).filter(r => r.type.toLowerCase() === msgType && (r.from_name === 'TF') === (numType === 'tf'));
+                    data.sort((a, b) => (a.latency === null) - (b.latency === null) || a.latency - b.latency);
+                    document.getElementById(key + '-results').style.display = 'block';
+                    buildTable(data, key + '-table');
                 }
             });
-        }, 3000);
+            source.addEventListener('complete', () => { markComplete(); source.close(); });
+        } else {
+            pollResults();
+        }
     </script>
 """ + HTML_FOOTER
+HTML_CAMPAIGN_RESULTS_PAGE = HTML_HEADER + """
+    <article>
+        <hgroup><h2>Campaign Results</h2><p id="status-text">{{ 'Could not start the campaign.' if error else 'Reading destinations and sending...' }}</p></hgroup>
+        {% if error %}<p class="error"><strong>Error:</strong> {{ error }}</p>
+        {% else %}
+        <progress id="progress" value="0" max="1"></progress>
+        <p id="counts"></p>
+        <ul id="errors" class="error"></ul>
+        <figure><table><thead><tr><th>Type</th><th>Sender</th><th>Carrier</th><th>Finished</th><th>Delivered</th><th>Failed</th><th>Timed Out</th><th>Errors</th><th>p50 (s)</th><th>p95 (s)</th><th>p99 (s)</th></tr></thead><tbody id="groups"></tbody></table></figure>
+        <p><a href="/bulk_results/{{ batch_id }}">Show every test</a></p>
+        <script>
+            const fmt = (value) => value === undefined ? 'N/A' : value.toFixed(2);
+            const esc = (value) => String(value).replace(/[&<>"]/g, (c) => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]));
+            function refresh() {
+                fetch('/api/batch_progress/{{ batch_id }}').then(response => response.json()).then(data => {
+                    if (data.error) { document.getElementById('status-text').innerText = data.error; clearInterval(timer); return; }
+                    const progress = document.getElementById('progress');
+                    progress.max = Math.max(data.total, 1); progress.value = data.finished;
+                    document.getElementById('counts').innerText = `${data.total} test(s) ${data.sealed ? 'dispatched' : 'dispatched so far'}, ${data.finished} finished, ${data.pending} pending` + (data.skipped ? `, ${data.skipped} row(s) skipped` : '');
+                    document.getElementById('errors').innerHTML = data.errors.map(e => `<li>${esc(e)}</li>`).join('');
+                    document.getElementById('groups').innerHTML = data.groups.map(g => `<tr><td>${esc(g.type)}</td><td>${esc(g.sender)}</td><td>${esc(g.carrier)}</td><td>${g.count}</td><td>${g.delivered}</td><td>${g.failed}</td><td>${g.timed_out}</td><td>${g.errors}</td><td>${fmt(g.latency.total?.p50)}</td><td>${fmt(g.latency.total?.p95)}</td><td>${fmt(g.latency.total?.p99)}</td></tr>`).join('');
+                    if (data.is_complete) { document.getElementById('status-text').innerText = data.timed_out ? 'Campaign complete; some tests timed out.' : 'Campaign complete.'; clearInterval(timer); }
+                });
+            }
+            const timer = setInterval(refresh, 2000);
+            refresh();
+        </script>
+        {% endif %}
+        <a href="/" role="button" class="secondary">Back to Dashboard</a>
+    </article>
+""" + HTML_FOOTER
+HTML_BATCH_ANALYSIS_RESULT = HTML_HEADER + """
+    <article>
+        <hgroup><h2>Batch Analysis Report</h2><p>{{ total }} URL(s) analyzed {{ concurrency }} at a time.</p></hgroup>
+        <div class="loader" id="loader"></div>
+        <figure><table><thead><tr><th>URL</th><th>Technical Details</th><th>Carrier Compatibility</th><th>Spam Risk Analysis</th></tr></thead><tbody>
+        {% for row in rows %}<tr><td style="word-break:break-all;"><a href="{{ row.url }}" target="_blank">{{ row.url }}</a></td>
+        {% if row.error %}<td colspan="3" class="error">{{ row.error }}</td>
+        {% else %}<td>{% for check in row.checks %}{{ check.icon }} {{ check.message }}<br>{% endfor %}</td><td>{% for carrier in row.analysis %}{{ '✅' if carrier.status == 'OK' else '❌' }} {{ carrier.name }}<br>{% endfor %}</td><td>{% for check in row.spam_checks %}{{ check.icon }} {{ check.message }}<br>{% endfor %}</td>{% endif %}</tr>
+        {% endfor %}
+        </tbody></table></figure>
+        <script>document.getElementById('loader').style.display = 'none';</script>
+        <a href="/#mms-analyzer" role="button" class="secondary">Back to Dashboard</a>
+    </article>
+""" + HTML_FOOTER
 HTML_ANALYSIS_RESULT = HTML_HEADER + """
     <article>
         <hgroup><h2>Analysis Report</h2><p><strong>URL:</strong> <a href="{{ url }}" target="_blank" style="word-break:break-all;">{{ url }}</a></p></hgroup>
@@ -186,11 +1671,84 @@ HTML_ANALYSIS_RESULT = HTML_HEADER + """
     </article>
 """ + HTML_FOOTER
 
+# --- STATIC ASSETS, TEMPLATE REGISTRY & COMPRESSION ---
+@dataclass(slots=True)
+class StaticAsset:
+    mimetype: str
+    body: bytes
+    etag: str
+    encoded: dict  # content-coding -> precompressed body
+
+def build_asset(text, mimetype):
+    body = text.encode()
+    encoded = {"gzip": gzip.compress(body, compresslevel=9)}
+    if brotli: encoded["br"] = brotli.compress(body, quality=11)
+    return StaticAsset(mimetype, body, hashlib.sha256(body).hexdigest()[:16], encoded)
+
+STATIC_ASSETS = {"dashboard.css": build_asset(DASHBOARD_CSS, "text/css"), "dashboard.js": build_asset(DASHBOARD_JS, "application/javascript")}
+
+@app.template_global()
+def asset_url(name):
+    """Versioned asset URL; the content hash changes whenever the asset does, so browsers may cache it forever."""
+    return url_for("static_asset", name=name, v=STATIC_ASSETS[name].etag)
+
+# Compiled once at startup instead of on every request.
+PAGE_TEMPLATES = {name: app.jinja_env.from_string(source) for name, source in {
+    "dashboard": HTML_DASHBOARD, "dlr_result": HTML_DLR_RESULT, "dlr_pending": HTML_DLR_PENDING, "bulk_results": HTML_BULK_RESULTS_PAGE,
+    "campaign_results": HTML_CAMPAIGN_RESULTS_PAGE, "batch_analysis": HTML_BATCH_ANALYSIS_RESULT, "analysis_result": HTML_ANALYSIS_RESULT,
+}.items()}
+
+def render_page(name, **context):
+    return render_template(PAGE_TEMPLATES[name], **context)
+
+def negotiate_encoding():
+    """Pick the client's preferred content-coding we can produce, or None."""
+    accepted = request.accept_encodings
+    options = [(accepted["br"], "br")] if brotli else []
+    options.append((accepted["gzip"], "gzip"))
+    quality, encoding = max(options, key=lambda option: option[0])
+    return encoding if quality > 0 else None
+
+def compress(data, encoding):
+    return brotli.compress(data, quality=5) if encoding == "br" else gzip.compress(data, compresslevel=6)
+
+@app.after_request
+def compress_response(response):
+    """Compress buffered HTML, JSON and text responses; streamed ones (SSE, batch analysis) go out as produced."""
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None or (response.content_length or 0) < COMPRESSION_MIN_BYTES:
+        return response
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
 # --- FLASK ROUTES ---
+@app.route("/assets/<name>")
+def static_asset(name):
+    asset = STATIC_ASSETS.get(name)
+    if asset is None:
+        return "Not Found", 404
+    encoding = negotiate_encoding()
+    body = asset.encoded.get(encoding, asset.body)
+    etag = f"{asset.etag}-{encoding}" if encoding in asset.encoded else asset.etag
+    # Only the URL carrying the current hash is immutable; anything else must revalidate.
+    cache_control = "public, max-age=31536000, immutable" if request.args.get("v") == asset.etag else "public, max-age=0, must-revalidate"
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    if encoding in asset.encoded:
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
 @app.route("/")
 @requires_auth
 def dashboard():
-    return render_template_string(HTML_DASHBOARD, numbers=DESTINATION_NUMBERS)
+    return render_page("dashboard", numbers=DESTINATION_NUMBERS, max_batch_urls=BATCH_ANALYSIS_MAX_URLS,
+                                  max_campaign_destinations=CAMPAIGN_MAX_DESTINATIONS, rate_limits=SENDER_RATE_LIMITS)
 
 @app.route("/health")
 def health_check():
@@ -207,76 +1765,81 @@ def run_latency_test():
     message_type = request.form["message_type"]
     text_content = request.form["message_text"]
     test_id = f"single_{time.time()}"
-    delivery_event = threading.Event()
-    active_tests[test_id] = {"event": delivery_event, "events": {}}
+    sender = "TF" if from_number_type == 'tf' else "10DLC"
+    test_registry.add(TestRecord(test_id, from_name=sender, from_num=from_number, to_num=destination_number,
+                                 carrier_name=DESTINATION_CARRIERS.get(destination_number, 'N/A'), type=message_type.upper()))
     args = (from_number, application_id, destination_number, message_type, text_content, test_id)
-    threading.Thread(target=send_message, args=args).start()
-    timeout = 60 if message_type == "mms" else 120
-    is_complete = delivery_event.wait(timeout=timeout)
-    result_data = active_tests.pop(test_id, {})
-    events = result_data.get("events", {})
-    if result_data.get("error"):
-        return render_template_string(HTML_DLR_RESULT, error=result_data["error"])
-    if not is_complete and message_type == "mms" and events.get("sent"):
-        return render_template_string(HTML_DLR_RESULT, status="sent", message_id=result_data.get("message_id"))
-    if not is_complete:
-        return render_template_string(HTML_DLR_RESULT, error=f"TIMEOUT: No final webhook was received after {timeout} seconds.")
-    events["total_latency"] = 0
-    if events.get("sent"): events["sent_str"] = datetime.fromtimestamp(events["sent"]).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-    if events.get("sending"):
-        events["sending_str"] = datetime.fromtimestamp(events["sending"]).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        events["sending_latency"] = events["sending"] - events.get("sent", 0)
-    if events.get("delivered"):
-        events["delivered_str"] = datetime.fromtimestamp(events["delivered"]).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        events["delivered_latency"] = events["delivered"] - events.get("sending", events.get("sent", 0))
-        events["total_latency"] = events["delivered"] - events.get("sent", 0)
-    return render_template_string(HTML_DLR_RESULT, message_id=result_data.get("message_id"), events=events)
+    dispatcher.submit(sender, send_message, *args)
+    return redirect(url_for('test_result_page', test_id=test_id))
+
+@app.route("/test_result/<test_id>")
+@requires_auth
+def test_result_page(test_id):
+    record = test_registry.get(test_id)
+    if record is None:
+        return render_page("dlr_result", error="Unknown or expired test ID.")
+    context = dlr_result_context(record)
+    expire_single_test(record, context)
+    if context is None:
+        return render_page("dlr_pending", test_id=test_id, timeout=single_test_timeout(record))
+    return render_page("dlr_result", **context)
+
+@app.route("/api/test_status/<test_id>")
+@requires_auth
+def api_test_status(test_id):
+    record = test_registry.get(test_id)
+    if record is None:
+        return jsonify({"is_complete": True, "status": "Unknown"})
+    context = dlr_result_context(record)
+    expire_single_test(record, context)
+    return jsonify({"is_complete": context is not None, "status": record.status})
 
 @app.route("/run_bulk_test", methods=["POST"])
 @requires_auth
 def run_bulk_test():
     batch_id = f"batch_{time.time()}"
-    active_tests[batch_id] = {"start_time": time.time(), "tests": {}}
-    from_numbers = [{"name": "TF", "number": TF_NUMBER, "appId": TF_APP_ID}, {"name": "10DLC", "number": TEN_DLC_NUMBER, "appId": TEN_DLC_APP_ID}]
-    message_types = ["sms", "mms"]
-    for dest_num, carrier_name in DESTINATION_NUMBERS:
-        for from_data in from_numbers:
-            for msg_type in message_types:
-                test_id = f"bulk_{time.time()}_{len(active_tests[batch_id]['tests'])}"
-                active_tests[test_id] = {
-                    "batch_id": batch_id, "from_name": from_data["name"], "from_num": from_data["number"],
-                    "to_num": dest_num, "carrier_name": carrier_name or 'N/A', "type": msg_type.upper(),
-                    "status": "Sending...", "latency": None
-                }
-                args = (from_data["number"], from_data["appId"], dest_num, msg_type, f"{from_data['name']} {msg_type.upper()} Test", test_id)
-                threading.Thread(target=send_message, args=args).start()
+    destinations = (((number, carrier_name or 'N/A'), None) for number, carrier_name in DESTINATION_NUMBERS)
+    start_campaign(batch_id, destinations, FROM_NUMBERS, ["sms", "mms"])
     return redirect(url_for('bulk_results_page', batch_id=batch_id))
 
+@app.route("/run_campaign", methods=["POST"])
+@requires_auth
+def run_campaign_test():
+    upload = request.files.get("destinations_file")
+    senders = [from_data for from_data in FROM_NUMBERS if from_data["name"] in request.form.getlist("senders")]
+    message_types = [msg_type for msg_type in ("sms", "mms") if msg_type in request.form.getlist("message_types")]
+    if not upload or not upload.filename or not senders or not message_types:
+        return render_page("campaign_results", error="Choose a destinations file and at least one sender and message type.")
+    fmt = "jsonl" if upload.filename.lower().endswith((".jsonl", ".ndjson")) else "csv"
+    fd, path = tempfile.mkstemp(prefix="campaign_", suffix=f".{fmt}")
+    with os.fdopen(fd, "wb") as f:
+        upload.save(f)  # copied in chunks; the file is then parsed line by line as the campaign is fed
+    batch_id = f"batch_{time.time()}"
+    start_campaign(batch_id, read_destinations(path, fmt), senders, message_types, request.form.get("message_text", "").strip() or None)
+    return redirect(url_for('campaign_results_page', batch_id=batch_id))
+
+@app.route("/campaign_results/<batch_id>")
+@requires_auth
+def campaign_results_page(batch_id):
+    return render_page("campaign_results", batch_id=batch_id)
+
+@app.route("/api/batch_progress/<batch_id>")
+@requires_auth
+def api_batch_progress(batch_id):
+    progress = test_registry.batch_progress(batch_id)
+    if progress is None:
+        return jsonify({"error": "Unknown or expired batch ID."}), 404
+    return jsonify(campaign_report(progress))
+
 @app.route("/bulk_results/<batch_id>")
 @requires_auth
 def bulk_results_page(batch_id):
-    return render_template_string(HTML_BULK_RESULTS_PAGE, batch_id=batch_id)
+    return render_page("bulk_results", batch_id=batch_id)
 
 @app.route("/api/bulk_status/<batch_id>")
 @requires_auth
 def api_bulk_status(batch_id):
-    all_tests = [test for test in active_tests.values() if test.get("batch_id") == batch_id]
-    is_complete = all(r['status'] not in ['Sending...', 'Sent'] for r in all_tests)
-    batch_start_time = 0
-    # Find batch start time by looking up the batch_id key in active_tests
-    if batch_id in active_tests:
-        batch_start_time = active_tests[batch_id].get("start_time", 0)
-
-    if not is_complete and batch_start_time and (time.time() - batch_start_time > 125):
-        is_complete = True
-        for test in all_tests:
-            if test['status'] == 'Sent': test['status'] = 'Timed Out'
-    
-    if is_complete and all_tests:
-        tests_to_remove = [tid for tid, test in active_tests.items() if test.get("batch_id") == batch_id]
-        for tid in tests_to_remove: active_tests.pop(tid, None)
-        active_tests.pop(batch_id, None) # Remove the batch record itself
-        
+    is_complete, all_tests = test_registry.poll_batch(batch_id)
     results_payload = {"sms": {"tf": [], "dlc": []}, "mms": {"tf": [], "dlc": []}}
     for test in all_tests:
         if test["type"] == 'SMS':
@@ -288,101 +1851,231 @@ def api_bulk_status(batch_id):
             results_payload[msg_type][num_type].sort(key=lambda x: (x['latency'] is None, x['latency']))
     return jsonify({"is_complete": is_complete, "results": results_payload})
 
+@app.route("/api/bulk_stream/<batch_id>")
+@requires_auth
+def api_bulk_stream(batch_id):
+    """Server-Sent Events feed of per-test changes; `Last-Event-ID` (or ?cursor=) resumes after a reconnect."""
+    try:
+        cursor = max(0, int(request.headers.get("Last-Event-ID") or request.args.get("cursor") or 0))
+    except ValueError:
+        cursor = 0  # not one of ours; resend everything, as the backends do for a cursor that is too large
+    def stream(cursor):
+        yield "retry: 2000\n\n"
+        while True:
+            version, is_complete, rows = test_registry.batch_changes(batch_id, cursor, wait=15)
+            if rows:
+                yield f"id: {version}\nevent: update\ndata: {json.dumps(rows)}\n\n"
+            if is_complete:
+                yield f"id: {version}\nevent: complete\ndata: {{}}\n\n"
+                return
+            if not rows:
+                yield ": keep-alive\n\n"
+            cursor = version
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream(cursor), mimetype="text/event-stream", headers=headers)
+
+@app.route("/api/latency_stats")
+@requires_auth
+def api_latency_stats():
+    """p50/p95/p99 and failure rates per sender/carrier/type, e.g. ?window=7d&interval=1d&carrier=Verizon."""
+    try:
+        window = parse_duration(request.args.get("window", "24h"))
+        interval = parse_duration(request.args["interval"]) if request.args.get("interval") else None
+        groups = latency_history.query(window, interval, sender=request.args.get("sender"),
+                                       carrier=request.args.get("carrier"), msg_type=request.args.get("type"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"window_seconds": window, "interval_seconds": interval, "groups": groups})
+
+@app.route("/api/sender_stats")
+@requires_auth
+def api_sender_stats():
+    return jsonify(dispatcher.stats())
+
 @app.route("/run_analysis", methods=["POST"])
 @requires_auth
 def run_analysis():
     media_url = request.form["media_url"]
-    checks, spam_checks, analysis, show_preview = [], [], [], False
     try:
-        response = requests.get(media_url, allow_redirects=True, timeout=10)
-        response.raise_for_status()
-        checks.append({"icon": "✅", "message": f"URL is accessible (Status Code: 200)."})
-        content_type = response.headers.get('Content-Type', 'N/A')
-        if any(t in content_type for t in ['image/jpeg', 'image/png', 'image/gif']):
-            checks.append({"icon": "✅", "message": f"Content-Type '{content_type}' is supported."}); show_preview = True
-        else:
-            checks.append({"icon": "⚠️", "message": f"Warning: Content-Type '{content_type}' may not be supported."})
-        size_in_kb = len(response.content) / 1024
-        checks.append({"icon": "✅", "message": f"File size is {size_in_kb:.0f} KB."})
-        for carrier, limit in CARRIER_LIMITS.items():
-            status, note = ("OK", f"Within ~{limit}KB limit.") if size_in_kb <= limit else ("REJECT", f"Exceeds ~{limit}KB limit.")
-            analysis.append({"name": carrier, "status": status, "note": note})
-        if show_preview:
-            img = Image.open(io.BytesIO(response.content)); width, height = img.size
-            aspect_ratio = height / width if width > 0 else 0
-            spam_checks.append({"icon": "✅" if aspect_ratio <= 3 else "⚠️", "message": "Standard aspect ratio." if aspect_ratio <= 3 else "Image is very tall/thin, may increase spam risk."})
-            try:
-                text_in_image = pytesseract.image_to_string(img)
-                spam_checks.append({"icon": "✅" if len(text_in_image.strip()) < 50 else "⚠️", "message": "Image is not primarily text-based." if len(text_in_image.strip()) < 50 else "Image contains significant text, increasing spam risk."})
-                if any(s in text_in_image for s in ['bit.ly', 't.co']):
-                    spam_checks.append({"icon": "❌", "message": "Image text contains a URL shortener, a high spam risk."})
-                else:
-                    spam_checks.append({"icon": "✅", "message": "No URL shorteners detected in image text."})
-            except Exception:
-                spam_checks.append({"icon": "⚠️", "message": "Could not perform OCR text analysis."})
-        return render_template_string(HTML_ANALYSIS_RESULT, url=media_url, checks=checks, spam_checks=spam_checks, analysis=analysis, show_preview=show_preview)
+        return render_page("analysis_result", url=media_url, **analyze_media(media_url))
     except requests.exceptions.RequestException as e:
-        return render_template_string(HTML_ANALYSIS_RESULT, url=media_url, error=f"Could not connect to URL. Error: {e}")
+        return render_page("analysis_result", url=media_url, error=f"Could not connect to URL. Error: {e}")
+
+@app.route("/run_batch_analysis", methods=["POST"])
+@requires_auth
+def run_batch_analysis():
+    media_urls = list(dict.fromkeys(request.form["media_urls"].split()))[:BATCH_ANALYSIS_MAX_URLS]
+    return stream_template(PAGE_TEMPLATES["batch_analysis"], rows=analyze_media_batch(media_urls), total=len(media_urls),
+                           concurrency=min(ANALYSIS_CONCURRENCY, len(media_urls)))
 
 @app.route("/webhook", methods=["POST"])
 def handle_webhook():
+    started, received_wall = time.monotonic(), time.time()
     data = request.get_json()
+    unknown = 0
     for event in data:
+        metrics.inc("sms_webhook_events_total", type=metric_label(event.get("type"), WEBHOOK_EVENT_TYPES))
         message_info = event.get("message", {})
         test_id_from_tag = message_info.get("tag")
-        if not test_id_from_tag: continue
-        
-        if test_id_from_tag in active_tests:
-            test_info = active_tests[test_id_from_tag]
-            event_type = event.get("type")
-            if event_type == "message-delivered":
-                start_time = test_info.get("start_time")
-                if start_time:
-                    test_info["latency"] = time.time() - start_time
-                    test_info["status"] = "Delivered"
-                if test_info.get("event"):
-                    test_info.setdefault("events", {})["delivered"] = time.time()
-                    test_info["event"].set()
-            elif event_type == "message-failed":
-                error_msg = f"Failed: {event.get('description')}"
-                test_info["status"] = error_msg
-                if test_info.get("event"):
-                    test_info["error"] = error_msg
-                    test_info["event"].set()
-            elif event_type == "message-sending" and test_info.get("events") is not None:
-                 test_info["events"]["sending"] = time.time()
+        if not test_id_from_tag or test_registry.update(test_id_from_tag, lambda test_info: apply_webhook_event(test_info, event, started, received_wall)) is None:
+            unknown += 1
+    metrics.inc("sms_webhook_requests_total")
+    if unknown: metrics.inc("sms_webhook_unknown_tag_total", unknown)
+    metrics.observe("sms_webhook_events_per_request", len(data))
+    metrics.observe("sms_webhook_processing_seconds", time.monotonic() - started)
     return "OK", 200
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint; set METRICS_REQUIRE_AUTH=true to put it behind the dashboard login."""
+    if METRICS_REQUIRE_AUTH and not (request.authorization and check_auth(request.authorization.username, request.authorization.password)):
+        return authenticate()
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # --- CORE LOGIC ---
 def send_message(from_number, application_id, destination_number, message_type, text_content, test_id):
-    api_url = f"https://messaging.bandwidth.com/api/v2/users/{BANDWIDTH_ACCOUNT_ID}/messages"
+    api_url = f"{BANDWIDTH_MESSAGING_URL}/users/{BANDWIDTH_ACCOUNT_ID}/messages"
     auth = (BANDWIDTH_API_TOKEN, BANDWIDTH_API_SECRET)
     headers = {"Content-Type": "application/json"}
     payload = {"to": [destination_number], "from": from_number, "text": text_content, "applicationId": application_id, "tag": test_id}
     if message_type == "mms":
         payload["media"] = [STATIC_MMS_IMAGE_URL]
+    sender = "TF" if from_number == TF_NUMBER else "10DLC"
     try:
-        response = requests.post(api_url, auth=auth, headers=headers, json=payload, timeout=15)
-        if test_id in active_tests:
-            if response.status_code == 202:
-                active_tests[test_id]["start_time"] = time.time()
-                active_tests[test_id]["status"] = "Sent"
-                if not test_id.startswith("bulk_"):
-                    active_tests[test_id]["message_id"] = response.json().get("id")
-                    active_tests[test_id].setdefault("events", {})["sent"] = active_tests[test_id]["start_time"]
-            else:
-                error_msg = f"API Error ({response.status_code})"
-                active_tests[test_id]["status"] = error_msg
-                if active_tests[test_id].get("event"):
-                    active_tests[test_id]["error"] = error_msg
-                    active_tests[test_id]["event"].set()
+        posted_wall, posted = time.time(), time.monotonic()
+        response = http_session.post(api_url, auth=auth, headers=headers, json=payload, timeout=15)
+        accepted = time.monotonic()
+        rtt = accepted - posted
+        metrics.observe("sms_api_post_seconds", rtt, sender=sender)
+        metrics.inc("sms_api_requests_total", sender=sender, status=str(response.status_code))
+        if response.status_code == 202:
+            body = response.json()
+            message_id = body.get("id")
+            created = parse_carrier_time(body.get("time"))
+            def mark_sent(test):
+                # Latency runs on Bandwidth's clock; our own observations are kept on the monotonic clock.
+                test.events["local_sent"] = accepted
+                test.events["local_clock"] = MONOTONIC_CLOCK_ID
+                test.events["api_rtt"] = rtt
+                if created is not None:
+                    test.events["clock_skew"] = posted_wall + rtt / 2 - created
+                if not test.start_time:
+                    test.start_time = created if created is not None else posted_wall + rtt
+                    test.events["sent"] = test.start_time
+                if test.status == "Sending...":
+                    test.status = "Sent"
+                test.message_id = message_id
+            test_registry.update(test_id, mark_sent)
+        else:
+            mark_error(test_id, f"API Error ({response.status_code})")
     except Exception as e:
-        error_msg = "Request Error"
-        if test_id in active_tests:
-            active_tests[test_id]["status"] = error_msg
-            if active_tests[test_id].get("event"):
-                active_tests[test_id]["error"] = str(e)
-                active_tests[test_id]["event"].set()
+        metrics.inc("sms_api_requests_total", sender=sender, status="error")
+        mark_error(test_id, "Request Error", str(e))
+
+def mark_error(test_id, status, detail=None):
+    def apply(test):
+        test.status = status
+        if test.batch_id is None:
+            test.error = detail or status
+    test_registry.update(test_id, apply)
+
+def single_test_timeout(record):
+    return 60 if record.type == "MMS" else 120
+
+def monotonic_clock_id():
+    """Identify the clock time.monotonic() reads: one per booted kernel, so containers on a host share it."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return platform.node()
+MONOTONIC_CLOCK_ID = monotonic_clock_id()
+
+def parse_carrier_time(value):
+    """Parse a Bandwidth ISO-8601 timestamp ("2024-05-01T12:00:00.123Z") into epoch seconds, or None."""
+    if not value: return None
+    try: return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError): return None
+
+def format_timestamp(ts):
+    return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+def expire_single_test(record, context):
+    """Record a single test as timed out once its result page gives up waiting, so the history sees it."""
+    if context is not None and not record.done and not record.error and record.status in PENDING_STATUSES:
+        test_registry.update(record.test_id, time_out_pending)
+
+def latency_legs(record):
+    """Return (leg 1, leg 2, total) latency in seconds from a test's event timestamps; missing legs are None."""
+    events = record.events or {}
+    sent, sending, delivered = events.get("sent"), events.get("sending"), events.get("delivered")
+    leg1 = sending - sent if sent and sending else None
+    leg2 = delivered - (sending or sent) if delivered and (sending or sent) else None
+    total = delivered - sent if sent and delivered else None
+    return leg1, leg2, total
+
+def clock_report(record):
+    """Return (clock skew, local overhead, API round trip) in seconds; unknown values are None.
+
+    Skew is our wall clock minus Bandwidth's, estimated at the midpoint of the send POST. Overhead is how much
+    longer the test looked from our own monotonic receipt times than from Bandwidth's timestamps; it is only known
+    when the send and the delivery receipt were handled on the same host.
+    """
+    events = record.events or {}
+    total = latency_legs(record)[2]
+    local_sent, local_delivered = events.get("local_sent"), events.get("local_delivered")
+    overhead = local_delivered - local_sent - total if total is not None and local_sent and local_delivered else None
+    return events.get("clock_skew"), overhead, events.get("api_rtt")
+
+def dlr_result_context(record):
+    """Build the HTML_DLR_RESULT context for a single test, or None while it is still awaiting its final webhook."""
+    timeout = single_test_timeout(record)
+    if record.error:
+        return {"error": record.error}
+    if not record.done and time.time() - record.created_at < timeout:
+        return None
+    events = dict(record.events or {})
+    if not record.done and record.type == "MMS" and events.get("sent"):
+        return {"status": "sent", "message_id": record.message_id}
+    if not record.done:
+        return {"error": f"TIMEOUT: No final webhook was received after {timeout} seconds."}
+    leg1, leg2, total = latency_legs(record)
+    events["total_latency"] = total or 0
+    if events.get("sent"): events["sent_str"] = format_timestamp(events["sent"])
+    if events.get("sending"):
+        events["sending_str"] = format_timestamp(events["sending"])
+        events["sending_latency"] = leg1 or 0
+    if events.get("delivered"):
+        events["delivered_str"] = format_timestamp(events["delivered"])
+        events["delivered_latency"] = leg2 or 0
+    skew, overhead, api_rtt = clock_report(record)
+    return {"message_id": record.message_id, "events": events, "clock": {"skew": skew, "overhead": overhead, "api_rtt": api_rtt}}
+
+def apply_webhook_event(test_info, event, received, received_wall):
+    """Apply one callback; `received` is the monotonic and `received_wall` the wall-clock time the request arrived."""
+    event_type = event.get("type")
+    # Prefer the event's own timestamp; without one, shift our receipt time onto Bandwidth's clock.
+    event_time = parse_carrier_time(event.get("time")) or received_wall - test_info.events.get("clock_skew", 0)
+    if not test_info.start_time:
+        # The callback beat our POST's response; the message creation time it carries is the same one the 202 has.
+        test_info.start_time = parse_carrier_time(event.get("message", {}).get("time"))
+        if test_info.start_time: test_info.events["sent"] = test_info.start_time
+    if event_type == "message-delivered":
+        if test_info.start_time:
+            test_info.latency = event_time - test_info.start_time
+            test_info.status = "Delivered"
+        test_info.events["delivered"] = event_time
+        if test_info.events.get("local_clock") == MONOTONIC_CLOCK_ID:  # the send may have been handled on another host
+            test_info.events["local_delivered"] = received
+        test_info.done = True
+    elif event_type == "message-failed":
+        error_msg = f"Failed: {event.get('description')}"
+        test_info.status = error_msg
+        if test_info.batch_id is None:
+            test_info.error = error_msg
+    elif event_type == "message-sending":
+        test_info.events["sending"] = event_time
+        test_info.events["local_sending"] = received
 
 # --- MAIN EXECUTION ---
 if __name__ == "__main__":
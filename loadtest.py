@@ -0,0 +1,349 @@
+# loadtest.py
+# Offline load test for the DLR testers. Runs the app against a local stand-in for the Bandwidth Messaging API,
+# which answers 202 with configurable latency and error rates, and replays message-sending / message-delivered /
+# message-failed callbacks to /webhook at controlled delays. Reports throughput, webhook handling latency,
+# memory and how far the app's measured latency drifts from the latency that was injected.
+#
+#   python loadtest.py --scenario bulk --destinations 50 --batches 4 --tf-rate 0 --dlc-rate 0
+#   python loadtest.py --scenario single --singles 200 --backend sqlite
+#   python loadtest.py --scenario bulk --backend postgres --database-url postgresql://localhost/sms_loadtest
+#   python loadtest.py --scenario campaign --campaign-size 2000   (upload a CSV and watch per-sender pacing)
+#   python loadtest.py --gevent ...   (serve the app with gevent, as gunicorn does in production)
+import sys
+if "--gevent" in sys.argv:
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse
+import heapq
+import json
+import logging
+import math
+import os
+import random
+import re
+import resource
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+AUTH = ("loadtest", "loadtest")
+CARRIERS = ["AT&T", "T-Mobile", "Verizon"]
+
+def percentile(values, q):
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+def summarize(values, scale=1.0):
+    if not values: return "n/a"
+    p50, p95, p99 = (percentile(values, q) * scale for q in (0.5, 0.95, 0.99))
+    return f"p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}  max {max(values) * scale:.1f}  (n={len(values)})"
+
+def iso_now(offset=0.0):
+    return datetime.fromtimestamp(time.time() + offset, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+# --- WEBHOOK REPLAYER ---
+class WebhookReplayer:
+    """Posts scheduled callbacks to the app's /webhook, grouping up to `batch_size` due events per request."""
+    def __init__(self, url, batch_size=1, workers=8):
+        self.url = url
+        self.batch_size = batch_size
+        self.post_latencies = []
+        self.dispatch_lags = []
+        self.posted_events = 0
+        self.errors = 0
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._session = requests.Session()
+        for _ in range(workers):
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def schedule(self, due, event):
+        """Queue `event` to be posted at monotonic time `due`."""
+        with self._cond:
+            heapq.heappush(self._heap, (due, self._seq, event))
+            self._seq += 1
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                now = time.monotonic()
+                batch = []
+                while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                    due, _, event = heapq.heappop(self._heap)
+                    self.dispatch_lags.append(now - due)
+                    batch.append(event)
+            started = time.perf_counter()
+            try:
+                response = self._session.post(self.url, json=batch, timeout=30)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            with self._cond:
+                self.post_latencies.append(time.perf_counter() - started)
+                self.posted_events += len(batch)
+                self.errors += not ok
+
+# --- FAKE MESSAGING API ---
+class BacklogHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128  # the default of 5 resets connections when the app opens a burst of them at once
+
+class FakeMessagingAPI:
+    """Local stand-in for POST /users/{accountId}/messages that also schedules the resulting DLR callbacks."""
+    def __init__(self, replayer, api_latency, api_error_rate, fail_rate, sending_delay, delivery_delay, jitter, seed=None):
+        self.replayer = replayer
+        self.api_latency = api_latency
+        self.api_error_rate = api_error_rate
+        self.fail_rate = fail_rate
+        self.sending_delay = sending_delay
+        self.delivery_delay = delivery_delay
+        self.jitter = jitter
+        self.injected = {}  # tag -> injected latency from the 202 response to the final callback, in seconds
+        self.accepted = 0
+        self.rejected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args): pass
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, body = fake.handle(payload)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                if status == 202:
+                    fake.schedule_callbacks(payload, body)
+
+        self.server = BacklogHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _jittered(self, seconds):
+        with self._lock:
+            return max(0.0, seconds * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def handle(self, payload):
+        time.sleep(self._jittered(self.api_latency))
+        with self._lock:
+            rejected = self._random.random() < self.api_error_rate
+            if rejected: self.rejected += 1
+            else: self.accepted += 1
+        if rejected:
+            return 500, {"type": "internal-server-error", "description": "Injected API error"}
+        return 202, {"id": uuid.uuid4().hex, "time": iso_now(), "to": payload.get("to"), "from": payload.get("from"),
+                     "applicationId": payload.get("applicationId"), "tag": payload.get("tag"), "media": payload.get("media", [])}
+
+    def schedule_callbacks(self, payload, message):
+        now = time.monotonic()
+        sending = self._jittered(self.sending_delay)
+        final = sending + self._jittered(self.delivery_delay)
+        with self._lock:
+            failed = self._random.random() < self.fail_rate
+            self.injected[payload.get("tag")] = final
+        info = {key: message[key] for key in ("id", "time", "to", "from", "applicationId", "tag")}
+        self.replayer.schedule(now + sending, {"type": "message-sending", "time": iso_now(sending), "description": "Message is sending to carrier", "message": info})
+        if failed:
+            self.replayer.schedule(now + final, {"type": "message-failed", "time": iso_now(final), "description": "Injected carrier rejection", "errorCode": 4432, "message": info})
+        else:
+            self.replayer.schedule(now + final, {"type": "message-delivered", "time": iso_now(final), "description": "Message delivered to carrier", "message": info})
+
+# --- APP UNDER TEST ---
+def configure_environment(args, fake_api_url, workdir):
+    """Point the app at the fake API. Must run before `app` is imported, since it reads its config at import time."""
+    destinations = " ".join(f"+1555{i:07d} ({CARRIERS[i % len(CARRIERS)]})" for i in range(args.destinations))
+    os.environ.update({
+        "BANDWIDTH_MESSAGING_URL": fake_api_url, "BANDWIDTH_ACCOUNT_ID": "loadtest", "BANDWIDTH_API_TOKEN": "token",
+        "BANDWIDTH_API_SECRET": "secret", "TF_NUMBER": "+18005550100", "TF_APP_ID": "tf-app", "TEN_DLC_NUMBER": "+19195550100",
+        "TEN_DLC_APP_ID": "dlc-app", "APP_USERNAME": AUTH[0], "APP_PASSWORD": AUTH[1], "DESTINATION_NUMBERS": destinations,
+        "STATE_BACKEND": args.backend, "STATE_DB_PATH": os.path.join(workdir, "state.db"), "STATE_DATABASE_URL": args.database_url,
+        "HISTORY_DB_PATH": os.path.join(workdir, "history.db"), "SENDER_POOL_SIZE": str(args.sender_pool),
+        "TF_RATE_LIMIT": str(args.tf_rate), "TEN_DLC_RATE_LIMIT": str(args.dlc_rate),
+    })
+
+def serve_app(flask_app, use_gevent):
+    if use_gevent:
+        from gevent.pywsgi import WSGIServer
+        server = WSGIServer(("127.0.0.1", 0), flask_app, log=None)
+        server.start()
+        return f"http://127.0.0.1:{server.server_port}"
+    from werkzeug.serving import make_server
+    server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+class ResourceSampler:
+    """Samples thread count and resident memory while a scenario runs."""
+    def __init__(self, interval=0.2):
+        self.peak_threads = threading.active_count()
+        self.peak_rss_mb = 0.0
+        self._stop = threading.Event()
+        self._interval = interval
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        page_mb = resource.getpagesize() / (1024 * 1024)
+        while not self._stop.wait(self._interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            try:
+                with open("/proc/self/statm") as statm:
+                    self.peak_rss_mb = max(self.peak_rss_mb, int(statm.read().split()[1]) * page_mb)
+            except OSError:
+                self.peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def stop(self):
+        self._stop.set()
+
+# --- SCENARIOS ---
+def run_bulk(base_url, session, args):
+    """Start `args.batches` bulk runs at once and poll them to completion; returns [(tag, status, measured latency)]."""
+    batch_ids = []
+    for _ in range(args.batches):
+        response = session.post(f"{base_url}/run_bulk_test", allow_redirects=False)
+        batch_ids.append(response.headers["Location"].rsplit("/", 1)[1])
+    results, deadline = {}, time.monotonic() + args.timeout
+    while batch_ids and time.monotonic() < deadline:
+        time.sleep(0.5)
+        for batch_id in list(batch_ids):
+            data = session.get(f"{base_url}/api/bulk_status/{batch_id}").json()
+            if data["is_complete"]:
+                batch_ids.remove(batch_id)
+                for group in data["results"].values():
+                    for rows in group.values():
+                        for row in rows:
+                            results[row["test_id"]] = (row["test_id"], row["status"], row["latency"])
+    return list(results.values())
+
+def run_campaign(base_url, session, args):
+    """Upload a CSV of `args.campaign_size` destinations as one campaign and poll its progress to completion."""
+    path = os.path.join(args.workdir, "campaign.csv")
+    with open(path, "w") as f:
+        f.write("number,carrier\n")
+        for index in range(args.campaign_size):
+            f.write(f"+1555{index:07d},{('AT&T', 'T-Mobile', 'Verizon')[index % 3]}\n")
+    with open(path, "rb") as f:
+        response = session.post(f"{base_url}/run_campaign", files={"destinations_file": ("campaign.csv", f)},
+                                data={"senders": ["TF", "10DLC"], "message_types": ["sms"]}, allow_redirects=False)
+    batch_id = response.headers["Location"].rsplit("/", 1)[1]
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        progress = session.get(f"{base_url}/api/batch_progress/{batch_id}").json()
+        if progress["is_complete"]:
+            break
+    for group in progress["groups"]:
+        print(f"  {group['type']} {group['sender']:<6} {group['carrier']:<9} {group['count']} finished, "
+              f"{group['delivered']} delivered, latency {json.dumps(group['latency'].get('total', {}))}")
+    data = session.get(f"{base_url}/api/bulk_status/{batch_id}").json()
+    return [(row["test_id"], row["status"], row["latency"]) for group in data["results"].values() for rows in group.values() for row in rows]
+
+def run_single(base_url, session, args):
+    """Start `args.singles` single-number tests concurrently and wait for each result page."""
+    def one(index):
+        form = {"from_number_type": "tf" if index % 2 else "10dlc", "destination_number": f"+1555{index % max(args.destinations, 1):07d}",
+                "message_type": "sms", "message_text": "load test"}
+        test_id = session.post(f"{base_url}/run_test", data=form, allow_redirects=False).headers["Location"].rsplit("/", 1)[1]
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            status = session.get(f"{base_url}/api/test_status/{test_id}").json()
+            if status["is_complete"]:
+                break
+            time.sleep(0.25)
+        page = session.get(f"{base_url}/test_result/{test_id}").text
+        match = re.search(r"Total End-to-End Latency: ([\d.]+)", page)
+        return test_id, status["status"], float(match.group(1)) if match else None
+    with ThreadPoolExecutor(max_workers=args.client_concurrency) as executor:
+        return list(executor.map(one, range(args.singles)))
+
+def report(name, results, elapsed, fake, replayer, sampler, sender_stats):
+    statuses = {}
+    for _, status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    delivered = [(tag, latency) for tag, status, latency in results if status == "Delivered" and latency is not None]
+    errors = [latency - fake.injected[tag] for tag, latency in delivered if tag in fake.injected]
+    print(f"\n=== {name} ===")
+    print(f"tests finished        {len(results)} in {elapsed:.2f}s  ({len(results) / elapsed:.1f} tests/s)")
+    print(f"statuses              {json.dumps(statuses)}")
+    print(f"API requests          {fake.accepted} accepted, {fake.rejected} rejected")
+    print(f"submit throughput     {sender_stats['completed'] / elapsed:.1f} msg/s, max queue depth {sender_stats['max_queue_depth']}, "
+          f"avg queue wait {sender_stats['queue_wait_avg'] * 1000:.1f} ms, avg submit {sender_stats['submit_latency_avg'] * 1000:.1f} ms")
+    print(f"webhook handling ms   {summarize(replayer.post_latencies, 1000)}  [{replayer.posted_events} events, {replayer.errors} errors]")
+    print(f"replayer lag ms       {summarize(replayer.dispatch_lags, 1000)}")
+    print(f"latency error ms      {summarize(errors, 1000)}  (measured - injected)")
+    print(f"peak threads / RSS    {sampler.peak_threads} / {sampler.peak_rss_mb:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against a fake Bandwidth Messaging API.")
+    parser.add_argument("--scenario", choices=["bulk", "single", "campaign", "both"], default="both")
+    parser.add_argument("--destinations", type=int, default=25, help="destinations per bulk batch (each gets 4 messages)")
+    parser.add_argument("--batches", type=int, default=2, help="bulk batches started at once")
+    parser.add_argument("--singles", type=int, default=50, help="single-number tests")
+    parser.add_argument("--campaign-size", type=int, default=200, help="destinations in the uploaded campaign file (SMS from both senders)")
+    parser.add_argument("--client-concurrency", type=int, default=32, help="concurrent single-test clients")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds the fake API takes to answer")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="fraction of sends rejected with HTTP 500")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of accepted messages that get message-failed")
+    parser.add_argument("--sending-delay", type=float, default=0.3, help="seconds from 202 to message-sending")
+    parser.add_argument("--delivery-delay", type=float, default=1.5, help="seconds from message-sending to the final callback")
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to every injected delay")
+    parser.add_argument("--webhook-batch", type=int, default=1, help="max callbacks per webhook request")
+    parser.add_argument("--webhook-workers", type=int, default=8, help="concurrent webhook posters")
+    parser.add_argument("--backend", choices=["memory", "sqlite", "postgres"], default="memory", help="STATE_BACKEND for the app")
+    parser.add_argument("--database-url", default="", help="STATE_DATABASE_URL for --backend postgres")
+    parser.add_argument("--sender-pool", type=int, default=16, help="SENDER_POOL_SIZE for the app")
+    parser.add_argument("--tf-rate", type=float, default=20, help="TF_RATE_LIMIT for the app (0 disables)")
+    parser.add_argument("--dlc-rate", type=float, default=10, help="TEN_DLC_RATE_LIMIT for the app (0 disables)")
+    parser.add_argument("--timeout", type=float, default=180, help="seconds to wait for a scenario to finish")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--gevent", action="store_true", help="serve the app with gevent instead of threads")
+    args = parser.parse_args()
+
+    workdir = args.workdir = tempfile.mkdtemp(prefix="sms-loadtest-")
+    replayer = WebhookReplayer(url=None, batch_size=args.webhook_batch, workers=args.webhook_workers)
+    fake = FakeMessagingAPI(replayer, args.api_latency, args.api_error_rate, args.fail_rate,
+                            args.sending_delay, args.delivery_delay, args.jitter, args.seed)
+    configure_environment(args, fake.url, workdir)
+    import app as app_module
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    base_url = serve_app(app_module.app, args.gevent)
+    replayer.url = f"{base_url}/webhook"
+    session = requests.Session()
+    session.auth = AUTH
+    print(f"app {base_url}  fake API {fake.url}  state backend {args.backend}  workdir {workdir}")
+
+    scenarios = {"bulk": run_bulk, "single": run_single, "campaign": run_campaign}
+    for name in (["bulk", "single"] if args.scenario == "both" else [args.scenario]):
+        replayer.post_latencies.clear(); replayer.dispatch_lags.clear()
+        fake.accepted = fake.rejected = replayer.posted_events = replayer.errors = 0
+        sampler = ResourceSampler()
+        baseline = app_module.dispatcher.stats()
+        started = time.monotonic()
+        results = scenarios[name](base_url, session, args)
+        elapsed = time.monotonic() - started
+        sampler.stop()
+        stats = app_module.dispatcher.stats()
+        stats["completed"] -= baseline["completed"]
+        report(name, results, elapsed, fake, replayer, sampler, stats)
+
+if __name__ == "__main__":
+    main()
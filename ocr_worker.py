@@ -0,0 +1,25 @@
+# ocr_worker.py
+# OCR job run in its own process by app.OcrPool: reads image bytes on stdin and writes the extracted text to stdout.
+# Kept free of app imports so it starts quickly and never runs the web app's startup code.
+import io
+import sys
+from PIL import Image
+import pytesseract
+
+TIMEOUT_EXIT_CODE = 3
+
+def extract_text(content, max_dimension, timeout):
+    img = Image.open(io.BytesIO(content))
+    img.draft("L", (max_dimension, max_dimension))  # JPEGs decode straight to a reduced grayscale image
+    img = img.convert("L")
+    img.thumbnail((max_dimension, max_dimension))
+    return pytesseract.image_to_string(img, timeout=timeout)
+
+if __name__ == "__main__":
+    max_dimension, timeout = int(sys.argv[1]), float(sys.argv[2])
+    try:
+        text = extract_text(sys.stdin.buffer.read(), max_dimension, timeout)
+    except RuntimeError as e:  # pytesseract kills tesseract and raises RuntimeError on timeout
+        print(e, file=sys.stderr)
+        sys.exit(TIMEOUT_EXIT_CODE if "timeout" in str(e).lower() else 1)
+    sys.stdout.buffer.write(text.encode("utf-8"))